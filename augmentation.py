@@ -0,0 +1,492 @@
+import hashlib
+import io
+import math
+import os
+import resource
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageFilter
+import numpy as np
+from tracing import TRACER
+
+# Suffixes of the PNGs written by add_noise_and_blur
+AUGMENTATION_SUFFIXES = ("_noisy", "_blurred", "_noisy_blurred")
+
+# Scratch buffers of the current thread, reused from one image to the next
+_buffers = threading.local()
+
+# Images with more pixels are augmented strip by strip, see augment_png_tiled
+TILE_PIXELS = 16_000_000
+
+def is_augmented(png_file):
+    """Check whether a PNG is an augmented version written by add_noise_and_blur."""
+    return os.path.splitext(png_file)[0].endswith(AUGMENTATION_SUFFIXES)
+
+def augmented_paths(file_path):
+    """
+    Paths of the augmented versions of a PNG, in the order of AUGMENTATION_SUFFIXES.
+    """
+    base_path, ext = os.path.splitext(file_path)
+    return [f"{base_path}{suffix}{ext}" for suffix in AUGMENTATION_SUFFIXES]
+
+def get_buffer(name, shape, dtype):
+    """
+    Get a scratch array of the current thread, only reallocated when a larger one is needed.
+
+    Args:
+        name (str): Name of the buffer.
+        shape (tuple): Shape of the returned array.
+        dtype: Type of the elements.
+
+    Returns:
+        numpy.ndarray: Uninitialized array of the given shape.
+    """
+    size = int(np.prod(shape))
+    buffer = getattr(_buffers, name, None)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+def peak_memory_mb():
+    """Peak resident memory of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+def rng_key(file_path, root_dir=None):
+    """
+    Stable name of an image for make_rng: its path relative to root_dir, with / separators.
+    """
+    if root_dir is not None:
+        file_path = os.path.relpath(file_path, root_dir)
+    return file_path.replace(os.sep, "/")
+
+def make_rng(seed=None, key=""):
+    """
+    Random generator of one image, independent of the worker processing it and of the
+    other images of the run, so adding or skipping images does not change its noise.
+
+    Args:
+        seed (int): Seed of the run (None for a different noise on every run).
+        key (str): Stable name of the image, see rng_key.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return np.random.default_rng(np.random.SeedSequence([seed, *struct.unpack("<4I", digest[:16])]))
+
+def add_noise(pixels, noise_level, rng):
+    """
+    Add uniform integer noise in [-noise_level, noise_level) to an image.
+
+    The result is written in a scratch buffer, so it is only valid until the next call
+    from the same thread.
+
+    Args:
+        pixels (numpy.ndarray): uint8 image.
+        noise_level (int): Amplitude of the noise.
+        rng (numpy.random.Generator): Generator of the noise.
+
+    Returns:
+        numpy.ndarray: Noisy uint8 image.
+    """
+    noise = get_buffer("noise", pixels.shape, np.float32)
+    rng.random(dtype=np.float32, out=noise)
+    noise *= 2 * noise_level
+    np.floor(noise, out=noise)
+    noise -= noise_level
+    noise += pixels
+    np.clip(noise, 0, 255, out=noise)
+
+    noisy = get_buffer("noisy", pixels.shape, np.uint8)
+    np.copyto(noisy, noise, casting="unsafe")
+    return noisy
+
+def augment_image(pixels, output_paths, noise_level=100, blur_radius=2, rng=None):
+    """
+    Write the noisy, blurred and noisy blurred versions of a decoded image.
+
+    Args:
+        pixels (numpy.ndarray): RGB uint8 image of shape (height, width, 3).
+        output_paths (list of str): Paths of the versions, in the order of AUGMENTATION_SUFFIXES.
+        noise_level (int): Amplitude of the noise.
+        blur_radius (float): Radius of the Gaussian blur.
+        rng (numpy.random.Generator): Generator of the noise.
+
+    Returns:
+        list of str: Paths of the written images.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    noisy_path, blurred_path, noisy_blurred_path = output_paths
+    blur = ImageFilter.GaussianBlur(radius=blur_radius)
+
+    noisy_img = Image.fromarray(add_noise(pixels, noise_level, rng), "RGB")
+    noisy_img.save(noisy_path)
+    noisy_img.filter(blur).save(noisy_blurred_path)
+    Image.fromarray(pixels, "RGB").filter(blur).save(blurred_path)
+    return list(output_paths)
+
+@TRACER.traced("augment", outputs=lambda png_paths: png_paths)
+def augment_png(file_path, noise_level=100, blur_radius=2, rng=None, tile_pixels=TILE_PIXELS):
+    """
+    Write the noisy, blurred and noisy blurred versions of a single PNG.
+
+    Images larger than tile_pixels are augmented strip by strip (see augment_png_tiled),
+    and their rows are decoded a strip at a time by PNGStreamReader, so the whole image
+    is never decoded. The PNGs it cannot read are decoded at once as before.
+
+    Returns:
+        list of str: Paths of the written images.
+    """
+    output_paths = augmented_paths(file_path)
+    # Image.open only reads the header, the pixels are decoded by convert
+    with Image.open(file_path) as img:
+        width, height = img.size
+        if width * height <= tile_pixels:
+            return augment_image(np.asarray(img.convert("RGB")), output_paths, noise_level, blur_radius, rng)
+        try:
+            reader = PNGStreamReader(file_path)
+        except ValueError:
+            reader = None
+        if reader is None:
+            pixels = np.asarray(img.convert("RGB"))
+    if reader is None:
+        return augment_png_tiled(array_strips(pixels), width, height, output_paths, noise_level, blur_radius, rng)
+    with reader:
+        return augment_png_tiled(reader.strips(), width, height, output_paths, noise_level, blur_radius, rng)
+
+def augment_pixels(pixels, output_paths, noise_level=100, blur_radius=2, rng=None, tile_pixels=TILE_PIXELS):
+    """
+    Write the augmented versions of a decoded image with augment_image, or strip by strip
+    with augment_png_tiled if it has more than tile_pixels pixels.
+
+    Returns:
+        list of str: Paths of the written images.
+    """
+    height, width = pixels.shape[:2]
+    if width * height > tile_pixels:
+        return augment_png_tiled(array_strips(pixels), width, height, output_paths, noise_level, blur_radius, rng)
+    return augment_image(pixels, output_paths, noise_level, blur_radius, rng)
+
+def array_strips(pixels, strip_height=256):
+    """Rows of a decoded image, strip_height at a time, as read by augment_png_tiled."""
+    for start in range(0, pixels.shape[0], strip_height):
+        yield pixels[start:start + strip_height]
+
+# Channels of the PNG color types read by PNGStreamReader: gray, RGB, palette, gray with alpha, RGBA
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+class PNGStreamReader:
+    def __init__(self, path, read_size=1 << 16):
+        """
+        PNG decoded a few rows at a time, so the whole image never has to be in memory.
+
+        The IDAT data is inflated incrementally and the filtered rows of every strip are
+        decoded by Pillow as a small PNG, preceded by the last decoded row which the
+        filters of the first row refer to.
+
+        :param path: Path of the PNG
+        :param read_size: Number of bytes read or inflated at a time
+        :raises ValueError: If the PNG is interlaced or does not have 8 bits per channel
+        """
+        self.file = open(path, "rb")
+        self.read_size = read_size
+        self.palette = b""
+        try:
+            if self.file.read(8) != b"\x89PNG\r\n\x1a\n":
+                raise ValueError(f"{path} is not a PNG")
+            kind, data = self._read_chunk_header()
+            if kind != b"IHDR":
+                raise ValueError(f"{path} does not start with IHDR")
+            header = self.file.read(data)
+            self.file.read(4)
+            self.width, self.height, bit_depth, self.color_type, _, _, interlace = struct.unpack(">IIBBBBB", header)
+            if bit_depth != 8 or interlace or self.color_type not in PNG_CHANNELS:
+                raise ValueError(f"{path} is interlaced or does not have 8 bits per channel")
+            # Chunks before the pixels, only the palette is needed to decode them
+            kind, self.chunk_left = self._read_chunk_header()
+            while kind != b"IDAT":
+                data = self.file.read(self.chunk_left)
+                self.file.read(4)
+                if kind == b"PLTE":
+                    self.palette = data
+                elif kind == b"IEND":
+                    raise ValueError(f"{path} has no IDAT chunk")
+                kind, self.chunk_left = self._read_chunk_header()
+        except (ValueError, struct.error):
+            self.file.close()
+            raise
+        self.row_bytes = 1 + self.width * PNG_CHANNELS[self.color_type]
+
+    def _read_chunk_header(self):
+        length, kind = struct.unpack(">I4s", self.file.read(8))
+        return kind, length
+
+    def _idat_data(self):
+        """Compressed pixels, read_size bytes at a time across the consecutive IDAT chunks."""
+        while True:
+            while self.chunk_left:
+                data = self.file.read(min(self.read_size, self.chunk_left))
+                if not data:
+                    return
+                self.chunk_left -= len(data)
+                yield data
+            self.file.read(4)
+            kind, self.chunk_left = self._read_chunk_header()
+            if kind != b"IDAT":
+                return
+
+    def _decode(self, filtered, previous_row, rows):
+        data = b"\x00" + previous_row + filtered
+        png = [b"\x89PNG\r\n\x1a\n", png_chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, rows + 1, 8, self.color_type, 0, 0, 0))]
+        if self.palette:
+            png.append(png_chunk(b"PLTE", self.palette))
+        png += [png_chunk(b"IDAT", zlib.compress(data, 0)), png_chunk(b"IEND", b"")]
+        with Image.open(io.BytesIO(b"".join(png))) as strip:
+            last_row = strip.crop((0, rows, self.width, rows + 1)).tobytes()
+            return np.asarray(strip.convert("RGB"))[1:], last_row
+
+    def strips(self, strip_height=256):
+        """
+        Decode the rows of the image.
+
+        :param strip_height: Number of rows decoded at a time
+        :return: Generator of RGB uint8 arrays of shape (n, width, 3), strip_height rows
+            each except the last one
+        """
+        inflater = zlib.decompressobj()
+        strip_bytes = strip_height * self.row_bytes
+        pending = bytearray()
+        # The rows before the first one are zeros for the filters
+        previous_row = bytes(self.row_bytes - 1)
+        rows_left = self.height
+        for data in self._idat_data():
+            while data and rows_left:
+                # The inflated data is bounded, a blank page compresses a thousand times
+                pending += inflater.decompress(data, strip_bytes)
+                data = inflater.unconsumed_tail
+                while rows_left and len(pending) >= min(strip_bytes, rows_left * self.row_bytes):
+                    rows = min(strip_height, rows_left)
+                    strip, previous_row = self._decode(bytes(pending[:rows * self.row_bytes]), previous_row, rows)
+                    del pending[:rows * self.row_bytes]
+                    rows_left -= rows
+                    yield strip
+        if rows_left:
+            pending += inflater.flush()
+            if len(pending) < rows_left * self.row_bytes:
+                raise ValueError(f"{self.file.name} is truncated")
+            yield self._decode(bytes(pending[:rows_left * self.row_bytes]), previous_row, rows_left)[0]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def png_chunk(kind, data):
+    """Bytes of a PNG chunk: length, type, data and CRC."""
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+class PNGStreamWriter:
+    def __init__(self, path, width, height, compress_level=6):
+        """
+        RGB PNG written a few rows at a time, so the whole image never has to be in memory.
+
+        :param path: Path of the PNG
+        :param width: Width of the image in pixels
+        :param height: Height of the image in pixels
+        :param compress_level: zlib compression level
+        """
+        self.file = open(path, "wb")
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.pending = []
+        self.pending_size = 0
+        self.previous_row = np.zeros((width, 3), dtype=np.uint8)
+
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bits per channel, truecolor, no interlacing
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, kind, data):
+        self.file.write(png_chunk(kind, data))
+
+    def _flush(self, data):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= 1 << 16:
+            self._write_chunk(b"IDAT", b"".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def write_rows(self, rows):
+        """
+        Append rows to the image.
+
+        :param rows: uint8 array of shape (n, width, 3)
+        """
+        # "Up" filter: every row is stored as its difference with the previous row
+        filtered = np.empty((len(rows), 1 + self.width * 3), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = (rows[0] - self.previous_row).reshape(-1)
+        filtered[1:, 1:] = (rows[1:] - rows[:-1]).reshape(len(rows) - 1, -1)
+        self.previous_row = rows[-1].copy()
+        self.rows_written += len(rows)
+        self._flush(self.compressor.compress(filtered.tobytes()))
+
+    def close(self):
+        """Finish the image and close the file."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Wrote {self.rows_written} rows of a PNG of height {self.height}")
+        self._flush(self.compressor.flush())
+        if self.pending:
+            self._write_chunk(b"IDAT", b"".join(self.pending))
+        self._write_chunk(b"IEND", b"")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+def augment_png_tiled(source_rows, width, height, output_paths, noise_level=100, blur_radius=2, rng=None, strip_height=256):
+    """
+    Same as augment_image, but processes the image in horizontal strips and writes the
+    versions incrementally. The source rows are read as they are needed, so the memory
+    used only depends on the width of the image, on strip_height and on the size of the
+    blocks of source_rows.
+
+    Every strip is blurred with blur_radius rows of context on both sides, so the result
+    is the same as blurring the whole image. The noise is drawn row after row from rng,
+    and the source and noisy rows needed as context of the next strip are kept in
+    rolling windows.
+
+    Args:
+        source_rows (iterable of numpy.ndarray): Consecutive RGB uint8 rows of the image in
+            blocks of shape (n, width, 3), e.g. PNGStreamReader.strips or array_strips.
+        width (int): Width of the image.
+        height (int): Height of the image.
+        output_paths (list of str): Paths of the versions, in the order of AUGMENTATION_SUFFIXES.
+        noise_level (int): Amplitude of the noise.
+        blur_radius (float): Radius of the Gaussian blur.
+        rng (numpy.random.Generator): Generator of the noise.
+        strip_height (int): Number of rows written at a time.
+
+    Returns:
+        list of str: Paths of the written images.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    blur = ImageFilter.GaussianBlur(radius=blur_radius)
+    # Rows around a strip that change the blur of its pixels (Pillow approximates the
+    # Gaussian with box blurs reaching about 3 radii)
+    margin = math.ceil(3 * blur_radius) + 1
+
+    def blur_rows(rows, start, end):
+        return np.asarray(Image.fromarray(rows, "RGB").filter(blur))[start:end]
+
+    # Source and noisy rows from window_start to noisy_end
+    source_rows = iter(source_rows)
+    source = window = np.empty((0, width, 3), dtype=np.uint8)
+    window_start = noisy_end = 0
+
+    writers = [PNGStreamWriter(path, width, height) for path in output_paths]
+    try:
+        noisy_writer, blurred_writer, noisy_blurred_writer = writers
+        for start in range(0, height, strip_height):
+            end = min(height, start + strip_height)
+            low, high = max(0, start - margin), min(height, end + margin)
+
+            source = source[low - window_start:]
+            while len(source) < high - low:
+                source = np.concatenate([source, next(source_rows)])
+            # Rows read past high are kept for the next strip
+            new_rows = add_noise(source[noisy_end - low:high - low], noise_level, rng)
+            window = np.concatenate([window[low - window_start:], new_rows])
+            window_start, noisy_end = low, high
+
+            noisy_writer.write_rows(window[start - low:end - low])
+            blurred_writer.write_rows(blur_rows(source[:high - low], start - low, end - low))
+            noisy_blurred_writer.write_rows(blur_rows(window, start - low, end - low))
+    except BaseException:
+        for writer in writers:
+            writer.file.close()
+        raise
+    for writer in writers:
+        writer.close()
+    return list(output_paths)
+
+def _augment_job(job):
+    file_path, noise_level, blur_radius, seed, key = job
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    paths = augment_png(file_path, noise_level, blur_radius, make_rng(seed, key))
+    timing = (start, time.perf_counter(), time.process_time() - cpu_start)
+    return os.getpid(), timing, peak_memory_mb(), paths
+
+@TRACER.traced()
+def augment_pngs(file_paths, noise_level=100, blur_radius=2, workers=None, seed=None, root_dir=None):
+    """
+    Augment a list of PNGs with a pool of processes and report the throughput and the
+    peak memory of every worker.
+
+    The noise of an image only depends on the seed and on its path relative to root_dir,
+    so the result does not depend on the number of workers or on the other images.
+
+    Args:
+        file_paths (list of str): PNGs to augment.
+        noise_level (int): Amplitude of the noise.
+        blur_radius (float): Radius of the Gaussian blur.
+        workers (int): Number of processes (None for one per CPU, 1 to run in this process).
+        seed (int): Seed of the noise.
+        root_dir (str): Output directory the image names of make_rng are relative to.
+
+    Returns:
+        list of list of str: Paths of the written images of every PNG.
+    """
+    if not file_paths:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+    jobs = [(file_path, noise_level, blur_radius, seed, rng_key(file_path, root_dir)) for file_path in file_paths]
+
+    start = time.perf_counter()
+    if workers == 1:
+        results = list(map(_augment_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_augment_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+    elapsed = time.perf_counter() - start
+
+    stats = {}
+    for (pid, (job_start, job_end, cpu_seconds), peak_mb, paths), file_path in zip(results, file_paths):
+        # The spans of the worker processes are recorded here
+        if workers > 1 and TRACER.enabled:
+            TRACER.add("augment_png", "augment", job_start, job_end, cpu_seconds, pid=pid, tid=pid,
+                       bytes_written=sum(os.path.getsize(path) for path in paths), file=file_path)
+        seconds = job_end - job_start
+        worker = stats.setdefault(pid, {"images": 0, "seconds": 0.0, "peak_mb": 0.0})
+        worker["images"] += 1
+        worker["seconds"] += seconds
+        worker["peak_mb"] = max(worker["peak_mb"], peak_mb)
+
+    print(f"Augmented {len(jobs)} images in {elapsed:.1f}s ({len(jobs) / elapsed:.1f} images/s) with {workers} workers.")
+    for pid, worker in sorted(stats.items()):
+        print(f"  worker {pid}: {worker['images']} images, {worker['images'] / worker['seconds']:.1f} images/s, peak memory {worker['peak_mb']:.0f} MB")
+
+    return [paths for _, _, _, paths in results]
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import add_irregularities, compile_tex_to_pdf, create_headers
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def legacy_font_template(header):
+    """
+    Rebuild a header as it was before the ML4Science font family was predeclared.
+
+    Every use of the \\mlsciencefont family is replaced by a \\fontspec{ML4Science}
+    call, which loads the font again on every use.
+
+    Args:
+        header (str): Header generated by create_headers for the ML4Science font.
+
+    Returns:
+        str: The same header with the old font switching.
+    """
+    header = header.replace("\\newfontfamily{\\mlsciencefont}{ML4Science}\n", "")
+    return header.replace("\\mlsciencefont", "\\fontspec{ML4Science}")
+
+
+def compile_corpus(header, corpus_dir, work_dir, runs):
+    """
+    Compile every exercise of the corpus with the given header.
+
+    Returns:
+        tuple: (timings, failures) with the compile time of every (run, exercise) pair
+            in seconds and the number of compilations that produced no PDF.
+    """
+    timings = []
+    failures = 0
+    for folder in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, folder, "content.tex"), "r", encoding="utf-8") as f:
+            tex_content = add_irregularities(f.read())
+
+        tex_path = os.path.join(work_dir, f"content_{folder}.tex")
+        with open(tex_path, "w", encoding="utf-8") as f:
+            f.write(header + tex_content)
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            pdf_path = compile_tex_to_pdf(tex_path, os.path.join(work_dir, "pdf"))
+            timings.append(time.perf_counter() - start)
+            if pdf_path is None:
+                failures += 1
+                print(f"Failed to compile exercise {folder}", file=sys.stderr)
+
+    return timings, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compile time of the ML4Science font template before and after predeclaring its font family.")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="Directory with one <n>/content.tex per exercise")
+    parser.add_argument("--runs", type=int, default=3, help="Number of compilations per exercise")
+    args = parser.parse_args()
+
+    # The same header is used for both variants, only the font switching differs
+    headers, _ = create_headers(["ML4Science"], grid=False)
+    variants = {"before": legacy_font_template(headers[0]), "after": headers[0]}
+
+    results = {}
+    for name, header in variants.items():
+        work_dir = tempfile.mkdtemp(prefix=f"bench_font_{name}_")
+        try:
+            timings, failures = compile_corpus(header, args.corpus, work_dir, args.runs)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results[name] = {
+            "compilations": len(timings),
+            "failures": failures,
+            "total_seconds": sum(timings),
+            "mean_seconds": sum(timings) / len(timings) if timings else None,
+        }
+
+    if results["before"]["total_seconds"] and results["after"]["total_seconds"]:
+        results["speedup"] = results["before"]["total_seconds"] / results["after"]["total_seconds"]
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
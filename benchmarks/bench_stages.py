@@ -0,0 +1,170 @@
+import argparse
+import json
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from augmentation import augment_png, make_rng, rng_key
+from rasterizer import pdfium
+from utils import add_headers_to_tex, compile_tex_job, convert_pdf_to_png, create_headers
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident memory in MB of this process (or of its largest child process)."""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def time_stage(items, func):
+    """
+    Run func on every item and time each call.
+
+    Returns:
+        tuple: (outputs, report) where outputs are the results of the successful calls
+            and report is the JSON summary of the stage.
+    """
+    timings = []
+    outputs = []
+    failures = 0
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        try:
+            output = func(item)
+        except Exception as e:
+            print(f"Failed on {item}: {e}", file=sys.stderr)
+            output = None
+        timings.append(time.perf_counter() - item_start)
+        if output is None:
+            failures += 1
+        else:
+            outputs.append(output)
+    total = time.perf_counter() - start
+
+    report = {
+        "files": len(timings),
+        "failures": failures,
+        "total_seconds": total,
+        "files_per_second": len(timings) / total if total > 0 else None,
+        "p50_seconds": percentile(timings, 0.5) if timings else None,
+        "p95_seconds": percentile(timings, 0.95) if timings else None,
+        # ru_maxrss never decreases, so these are the peaks up to the end of the stage
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_child_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+    return outputs, report
+
+
+def skipped(reason):
+    print(f"Skipping: {reason}", file=sys.stderr)
+    return {"skipped": reason}
+
+
+def bench_glyph_extraction(work_dir, templates):
+    """
+    Time extract_glyphs on blank templates, it needs potrace and the generate_font dependencies.
+    """
+    if shutil.which("potrace") is None:
+        return skipped("potrace is not installed")
+    sys.path.insert(0, os.path.join(ROOT_DIR, "generate_font"))
+    try:
+        from glyphs_extraction import extract_glyphs
+        from config import BORDER_COLOR, BORDER_WIDTH, TEMPLATE_HEIGHT, TEMPLATE_WIDTH
+    except ImportError as e:
+        return skipped(f"glyph extraction dependencies are missing ({e})")
+    from PIL import Image
+
+    template_dir = os.path.join(work_dir, "templates")
+    os.makedirs(template_dir)
+    template_files = []
+    for i in range(templates):
+        template_file = f"template_{i}.png"
+        Image.new("RGB", (TEMPLATE_WIDTH, TEMPLATE_HEIGHT), "white").save(os.path.join(template_dir, template_file))
+        template_files.append(template_file)
+
+    def extract(template_file):
+        extract_glyphs(template_dir, [template_file], BORDER_COLOR, BORDER_WIDTH, os.path.join(work_dir, "glyphs"))
+        return template_file
+
+    _, report = time_stage(template_files, extract)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the pipeline on the offline corpus and print a JSON report.")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="Directory with one <n>/content.tex per exercise")
+    parser.add_argument("--fonts", nargs="+", default=["ML4Science"], help="Fonts of the header variants")
+    parser.add_argument("--dpi", type=int, default=500, help="Resolution of the PNGs")
+    parser.add_argument("--templates", type=int, default=2, help="Number of blank templates for the glyph extraction")
+    parser.add_argument("--output", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_stages_")
+    report = {"dpi": args.dpi, "fonts": args.fonts}
+    try:
+        latex_dir = os.path.join(work_dir, "latex")
+        content_paths = []
+        for folder in sorted(os.listdir(args.corpus), key=lambda f: (len(f), f)):
+            source = os.path.join(args.corpus, folder, "content.tex")
+            if os.path.isfile(source):
+                os.makedirs(os.path.join(latex_dir, folder))
+                content_paths.append(shutil.copy(source, os.path.join(latex_dir, folder, "content.tex")))
+        report["exercises"] = len(content_paths)
+
+        headers, paths = create_headers(args.fonts, ["white"], ["black"], grid=False)
+        tex_lists, report["headers"] = time_stage(content_paths, lambda path: add_headers_to_tex(path, headers, paths, seed=0))
+        tex_paths = [tex_path for tex_list in tex_lists for tex_path in tex_list]
+
+        if shutil.which("xelatex") is None:
+            report["xelatex"] = skipped("xelatex is not installed")
+            pdf_paths = []
+        else:
+            def compile_tex(tex_path):
+                folder = os.path.basename(os.path.dirname(tex_path))
+                return compile_tex_job(tex_path, os.path.join(work_dir, "generated", folder))[1]
+            pdf_paths, report["xelatex"] = time_stage(tex_paths, compile_tex)
+
+        raster_stage = "raster_pdfium" if pdfium is not None else "raster_pdftoppm"
+        if not pdf_paths:
+            report[raster_stage] = skipped("no PDF to rasterize")
+            png_paths = []
+        elif pdfium is None and shutil.which("pdftoppm") is None:
+            report[raster_stage] = skipped("neither pypdfium2 nor pdftoppm is installed")
+            png_paths = []
+        else:
+            png_paths, report[raster_stage] = time_stage(pdf_paths, lambda pdf_path: convert_pdf_to_png(pdf_path, args.dpi))
+
+        if not png_paths:
+            report["augment"] = skipped("no PNG to augment")
+        else:
+            _, report["augment"] = time_stage(png_paths, lambda png_path: augment_png(png_path, rng=make_rng(0, rng_key(png_path, work_dir))))
+
+        report["glyph_extraction"] = bench_glyph_extraction(work_dir, args.templates)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
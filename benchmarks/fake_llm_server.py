@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+# Separator lines of the batched prompts, see LatexGenerator.build_batch_request
+SEPARATOR_PATTERN = re.compile(r"^%%%% EXERCISE (\d+) %%%%$", re.MULTILINE)
+
+
+def load_corpus(corpus_dir):
+    """
+    Load the content.tex of every exercise of the corpus.
+
+    Returns:
+        list of str: The LaTeX answers served by the server.
+    """
+    answers = []
+    for folder in sorted(os.listdir(corpus_dir)):
+        tex_path = os.path.join(corpus_dir, folder, "content.tex")
+        if os.path.isfile(tex_path):
+            with open(tex_path, "r", encoding="utf-8") as f:
+                answers.append(f.read())
+    return answers
+
+
+def make_handler(answers, latency, chunk_size, failure_rate, unusable_rate=0.0):
+    """
+    Create a request handler answering chat completions with exercises of the corpus.
+
+    Args:
+        answers (list of str): Answers to serve, picked at random.
+        latency (float): Delay before the first chunk in seconds.
+        chunk_size (int): Number of characters per streamed chunk.
+        failure_rate (float): Fraction of requests answered with an error (429 or 500).
+        unusable_rate (float): Fraction of answers with a preamble and a runaway body.
+    """
+
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            if random.random() < failure_rate:
+                status = random.choice([429, 500])
+                self.send_json(status, {"error": {"message": "Simulated failure", "type": "server_error"}})
+                return
+
+            time.sleep(latency)
+
+            def pick_answer():
+                answer = random.choice(answers)
+                if random.random() < unusable_rate:
+                    answer = "\\documentclass{article}\n\\usepackage{amsmath}\n" + answer.replace("\\end{document}", "$x^2$ " * 5000)
+                return answer
+
+            prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+            batch = SEPARATOR_PATTERN.findall(prompt)
+            if batch:
+                # One document per exercise of a batched prompt
+                answer = "".join(f"%%%% EXERCISE {number} %%%%\n{pick_answer()}\n" for number in batch)
+            else:
+                answer = pick_answer()
+            model = request.get("model", "fake")
+
+            if not request.get("stream"):
+                self.send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for start in range(0, len(answer), chunk_size):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": answer[start:start + chunk_size]}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return FakeLLMHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the benchmark corpus through a local OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="Directory with one <n>/content.tex per exercise")
+    parser.add_argument("--latency", type=float, default=0.5, help="Delay before the first chunk in seconds")
+    parser.add_argument("--chunk-size", type=int, default=4, help="Number of characters per streamed chunk")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--unusable-rate", type=float, default=0.0, help="Fraction of answers the generator should reject")
+    args = parser.parse_args()
+
+    handler = make_handler(load_corpus(args.corpus), args.latency, args.chunk_size, args.failure_rate, args.unusable_rate)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Serving on http://{args.host}:{args.port}/v1 (use it as base_url of LatexGenerator)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import threading
+
+def hash_file(path):
+    """Hash the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_values(*values):
+    """Hash a list of JSON-serializable values (hashes, parameters...)."""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class BuildManifest:
+    def __init__(self, path="data/manifest.json"):
+        """
+        Record of the inputs and artifacts of every build step, used to skip the steps
+        whose inputs did not change since the previous run.
+
+        Entries are grouped by stage ("compile", "raster", "augment") and keyed by the
+        main artifact of the step.
+
+        :param path: JSON file where the manifest is stored
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_fresh(self, stage, key, inputs):
+        """
+        Check whether a step already ran with the same inputs and its artifacts still exist.
+
+        :param stage: Name of the stage
+        :param key: Key of the step within the stage
+        :param inputs: Hash of everything the step depends on
+        """
+        with self.lock:
+            entry = self.entries.get(stage, {}).get(key)
+        if entry is None or entry["inputs"] != inputs:
+            return False
+        return all(os.path.exists(output) for output in entry["outputs"])
+
+    def record(self, stage, key, inputs, outputs):
+        """
+        Record the inputs and artifacts of a step that just ran.
+
+        :param outputs: Paths of the artifacts produced by the step
+        """
+        with self.lock:
+            self.entries.setdefault(stage, {})[key] = {"inputs": inputs, "outputs": list(outputs)}
+
+    def save(self):
+        """Write the manifest to disk."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
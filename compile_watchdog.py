@@ -0,0 +1,96 @@
+import os
+import re
+import threading
+
+# Any error of a xelatex log
+ERROR_PATTERN = re.compile(r"^! ", re.MULTILINE)
+
+# Errors of a xelatex log, from the most to the least specific
+FAILURE_PATTERNS = [
+    ("undefined_control_sequence", re.compile(r"^! Undefined control sequence\.", re.MULTILINE)),
+    ("runaway_argument", re.compile(r"^Runaway argument\?", re.MULTILINE)),
+    ("latex_error", ERROR_PATTERN),
+]
+
+# Characters missing from the font, xelatex falls back to another font for them
+MISSING_GLYPH_PATTERN = re.compile(r"^Missing character: There is no", re.MULTILINE)
+
+def classify_compile(log_path, status, pdf_ok):
+    """
+    Classify the outcome of a xelatex run from its log.
+
+    Args:
+        log_path (str): Path of the .log written by xelatex.
+        status (str): Status of the command, see os_utils.run_process.
+        pdf_ok (bool): Whether a PDF was produced.
+
+    Returns:
+        str: "timeout", "undefined_control_sequence", "runaway_argument", "latex_error"
+        or "no_log" for failed runs, "missing_glyph" for PDFs with fallback glyphs and
+        "ok" otherwise. In nonstopmode xelatex still writes a PDF after an error, so a
+        run with a PDF is classified as failed too if xelatex exited with an error or
+        logged one, although its PDF is still used.
+    """
+    if status == "timeout":
+        return "timeout"
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            log = f.read()
+    except FileNotFoundError:
+        return "ok" if pdf_ok and status == "ok" else "no_log"
+
+    if not pdf_ok or status == "failed" or ERROR_PATTERN.search(log):
+        for failure_class, pattern in FAILURE_PATTERNS:
+            if pattern.search(log):
+                return failure_class
+        return "latex_error"
+    if MISSING_GLYPH_PATTERN.search(log):
+        return "missing_glyph"
+    return "ok"
+
+class CompileStats:
+    def __init__(self):
+        """
+        Number of compilations and time spent per outcome (see classify_compile).
+        """
+        self.lock = threading.Lock()
+        self.outcomes = {}
+
+    def record(self, tex_path, outcome, seconds):
+        """
+        Record one compilation.
+
+        :param tex_path: Compiled TeX file
+        :param outcome: Class returned by classify_compile
+        :param seconds: Wall time of the compilation
+        """
+        with self.lock:
+            entry = self.outcomes.setdefault(outcome, {"count": 0, "seconds": 0.0, "examples": []})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            if len(entry["examples"]) < 3:
+                entry["examples"].append(tex_path)
+
+    def summary(self):
+        """
+        Returns:
+            dict: For every outcome, the number of compilations, the time spent and up to
+            3 example files.
+        """
+        with self.lock:
+            return {outcome: dict(entry, examples=list(entry["examples"])) for outcome, entry in self.outcomes.items()}
+
+    def print_summary(self):
+        """Print the time spent on every outcome, the failures first."""
+        summary = self.summary()
+        if not summary:
+            return
+        total = sum(entry["seconds"] for entry in summary.values())
+        print("Compile time per outcome:")
+        for outcome, entry in sorted(summary.items(), key=lambda item: (item[0] == "ok", -item[1]["seconds"])):
+            share = entry["seconds"] / total if total > 0 else 0
+            print(f"  {outcome}: {entry['count']} files, {entry['seconds']:.1f}s ({share:.0%})"
+                  + ("" if outcome == "ok" else f", e.g. {os.path.basename(entry['examples'][0])}"))
+
+# Outcomes of all the compilations of the run
+COMPILE_STATS = CompileStats()
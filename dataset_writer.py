@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import tarfile
+from os_utils import get_subfolders
+from utils import parse_variant_name
+from tracing import TRACER
+
+class ShardWriter:
+    def __init__(self, output_dir="data/shards", max_shard_bytes=1 << 30, max_shard_samples=10000):
+        """
+        Writer packing samples into WebDataset-style tar shards.
+
+        Every file of a sample is stored as <key>.<extension> next to the other files of
+        the sample. An index of the position of every file in the shards is written to
+        output_dir/index.json when the writer is closed, see ShardReader.
+
+        :param output_dir: Directory where the shards are written
+        :param max_shard_bytes: Size after which a new shard is started
+        :param max_shard_samples: Number of samples after which a new shard is started
+        """
+        self.output_dir = output_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_samples = max_shard_samples
+        self.shards = []
+        self.samples = {}
+        self.tar = None
+        self.shard_bytes = 0
+        self.shard_samples = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _open_shard(self):
+        shard_name = f"shard-{len(self.shards):06d}.tar"
+        self.shards.append(shard_name)
+        self.tar = tarfile.open(os.path.join(self.output_dir, shard_name), "w", format=tarfile.GNU_FORMAT)
+        self.shard_bytes = 0
+        self.shard_samples = 0
+
+    def _close_shard(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        self.tar = None
+
+    def write(self, key, files):
+        """
+        Add a sample to the current shard.
+
+        :param key: Unique name of the sample, without extension
+        :param files: Dictionary mapping the extensions (png, tex, json...) to the content (bytes)
+        """
+        if key in self.samples:
+            raise ValueError(f"Sample {key} was already written")
+        size = sum(len(data) for data in files.values())
+        if self.tar is None or (self.shard_samples > 0 and (self.shard_bytes + size > self.max_shard_bytes
+                                                             or self.shard_samples >= self.max_shard_samples)):
+            self._close_shard()
+            self._open_shard()
+
+        # The key is indexed right away, so a duplicate in the open shard is caught too
+        sample = self.samples[key] = {"shard": len(self.shards) - 1, "files": {}}
+        for extension, data in files.items():
+            info = tarfile.TarInfo(f"{key}.{extension}")
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+            # The data ends the member, padded to a whole block, whatever the size of the
+            # headers (long names take several)
+            padded_size = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            sample["files"][extension] = [self.tar.offset - padded_size, len(data)]
+        self.shard_bytes += size
+        self.shard_samples += 1
+
+    def close(self):
+        """Finish the last shard and write the index."""
+        self._close_shard()
+        index_path = os.path.join(self.output_dir, "index.json")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"shards": self.shards, "samples": self.samples}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ShardReader:
+    def __init__(self, shard_dir="data/shards"):
+        """
+        Random access to the samples written by ShardWriter, through the index.
+
+        :param shard_dir: Directory containing the shards and index.json
+        """
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, "index.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.samples = index["samples"]
+        self.files = {}
+
+    def keys(self):
+        """Keys of all the samples, in shard order."""
+        return list(self.samples)
+
+    def read(self, key, extension):
+        """
+        Read one file of a sample.
+
+        :param key: Key of the sample
+        :param extension: Extension of the file (png, tex, json...)
+        :return: Content of the file (bytes)
+        """
+        sample = self.samples[key]
+        offset, size = sample["files"][extension]
+        shard = sample["shard"]
+        if shard not in self.files:
+            self.files[shard] = open(os.path.join(self.shard_dir, self.shards[shard]), "rb")
+        f = self.files[shard]
+        f.seek(offset)
+        return f.read(size)
+
+    def sample(self, key):
+        """
+        Read all the files of a sample.
+
+        :return: Dictionary mapping the extensions to the contents, the metadata is decoded
+        """
+        files = {extension: self.read(key, extension) for extension in self.samples[key]["files"]}
+        if "json" in files:
+            files["json"] = json.loads(files["json"])
+        return files
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+@TRACER.traced()
+def write_dataset_shards(generated_dir="data/generated", latex_dir="data/latex", output_dir="data/shards",
+                         max_shard_bytes=1 << 30, max_shard_samples=10000, delete_pngs=False):
+    """
+    Pack the PNGs of every exercise into tar shards, along with the LaTeX source of the
+    exercise and the attributes of the variant.
+
+    The sample of generated_dir/<i>/<name>.png has the key <i>/<name> and contains
+    <i>/<name>.png, <i>/<name>.tex (the content.tex of the exercise) and <i>/<name>.json.
+
+    Args:
+        generated_dir (str): Directory of the generated images, one subfolder per exercise.
+        latex_dir (str): Directory of the generated LaTeX files.
+        output_dir (str): Directory where the shards and the index are written.
+        max_shard_bytes (int): Size after which a new shard is started.
+        max_shard_samples (int): Number of samples after which a new shard is started.
+        delete_pngs (bool): Delete the PNGs once they are packed.
+
+    Returns:
+        int: Number of samples written.
+    """
+    print("Writing dataset shards...")
+    written = 0
+    with ShardWriter(output_dir, max_shard_bytes, max_shard_samples) as writer:
+        for folder in sorted(get_subfolders(generated_dir), key=lambda f: (len(f), f)):
+            tex_path = os.path.join(latex_dir, folder, "content.tex")
+            tex = b""
+            if os.path.exists(tex_path):
+                with open(tex_path, "rb") as f:
+                    tex = f.read()
+
+            folder_path = os.path.join(generated_dir, folder)
+            for png_file in sorted(f for f in os.listdir(folder_path) if f.endswith(".png")):
+                png_path = os.path.join(folder_path, png_file)
+                with open(png_path, "rb") as f:
+                    png = f.read()
+                metadata = {"exercise": folder, "file": png_file, **(parse_variant_name(png_file) or {})}
+
+                writer.write(f"{folder}/{os.path.splitext(png_file)[0]}", {
+                    "png": png,
+                    "tex": tex,
+                    "json": json.dumps(metadata).encode("utf-8"),
+                })
+                written += 1
+                if delete_pngs:
+                    os.remove(png_path)
+
+    print(f"Wrote {written} samples to {len(writer.shards)} shards.")
+    return written
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+import numpy as np
+
+# Parameters of the hash permutations, as in the usual MinHash implementations
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+COMMENT_PATTERN = re.compile(r"(?<!\\)%[^\n]*")
+DOCUMENT_PATTERN = re.compile(r"\\(?:begin|end)\{document\}")
+
+def normalize_tex(tex_content):
+    """
+    Normalize a content.tex so that exercises differing only by their case, comments or
+    spacing are identical. The digits are kept, since the exercises of the same prompt
+    mostly differ by their numbers.
+    """
+    text = COMMENT_PATTERN.sub("", tex_content)
+    text = DOCUMENT_PATTERN.sub("", text).lower()
+    return " ".join(text.split())
+
+class DedupIndex:
+    def __init__(self, db_path="data/dedup.sqlite", threshold=0.8, num_perm=128, bands=16, shingle_size=5, seed=1):
+        """
+        Persistent index of the generated exercises, finding the near-duplicates of a new
+        exercise by MinHash and locality-sensitive hashing.
+
+        Every exercise gets a MinHash signature of the character shingles of its normalized
+        text. The signature is split into bands, and the exercises sharing a band are
+        candidates whose similarity is estimated from the signatures. The bands are stored
+        in an indexed SQLite table, so a lookup costs one index search per band.
+
+        :param db_path: SQLite file of the index, reused across runs
+        :param threshold: Estimated Jaccard similarity above which an exercise is a duplicate
+        :param num_perm: Length of the signatures
+        :param bands: Number of bands, num_perm / bands rows each
+        :param shingle_size: Number of characters of the shingles
+        :param seed: Seed of the hash permutations, must not change for an existing index
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The generation threads of the streaming pipeline share the connection
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, name TEXT UNIQUE, signature BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, hash INTEGER, document INTEGER, PRIMARY KEY (band, hash, document)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_document ON bands (document)")
+
+        settings = f"{num_perm}:{bands}:{shingle_size}:{seed}"
+        stored = self.db.execute("SELECT value FROM settings WHERE name = 'minhash'").fetchone()
+        if stored is None:
+            self.db.execute("INSERT INTO settings VALUES ('minhash', ?)", (settings,))
+        elif stored[0] != settings:
+            raise ValueError(f"{db_path} was built with other MinHash settings ({stored[0]} instead of {settings})")
+        self.db.commit()
+
+    def signature(self, tex_content):
+        """
+        MinHash signature of a document.
+
+        Returns:
+            numpy.ndarray: num_perm uint32 values.
+        """
+        text = normalize_tex(tex_content)
+        size = self.shingle_size
+        shingles = {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        # The products wrap around 2^64 like in the usual implementations, which keeps them fast
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_hashes(self, signature):
+        """Hash of every band of a signature, as signed 64-bit SQLite integers."""
+        return [
+            int.from_bytes(hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(), "little", signed=True)
+            for band in range(self.bands)
+        ]
+
+    def query(self, tex_content, signature=None):
+        """
+        Find the indexed documents similar to a document.
+
+        Returns:
+            list of tuple: (name, estimated similarity) of the documents above the threshold,
+            the most similar first.
+        """
+        if signature is None:
+            signature = self.signature(tex_content)
+        matches = []
+        with self.lock:
+            candidates = set()
+            for band, band_hash in enumerate(self.band_hashes(signature)):
+                rows = self.db.execute("SELECT document FROM bands WHERE band = ? AND hash = ?", (band, band_hash))
+                candidates.update(row[0] for row in rows)
+            for document in candidates:
+                name, stored = self.db.execute("SELECT name, signature FROM documents WHERE id = ?", (document,)).fetchone()
+                similarity = float(np.mean(np.frombuffer(stored, dtype=np.uint32) == signature))
+                if similarity >= self.threshold:
+                    matches.append((name, similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def add(self, name, tex_content, signature=None):
+        """
+        Index a document, replacing the previous document with the same name.
+        """
+        if signature is None:
+            signature = self.signature(tex_content)
+        with self.lock:
+            previous = self.db.execute("SELECT id FROM documents WHERE name = ?", (name,)).fetchone()
+            if previous is not None:
+                self.db.execute("DELETE FROM bands WHERE document = ?", previous)
+                self.db.execute("DELETE FROM documents WHERE id = ?", previous)
+            document = self.db.execute("INSERT INTO documents (name, signature) VALUES (?, ?)", (name, signature.tobytes())).lastrowid
+            self.db.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?, ?)",
+                                [(band, band_hash, document) for band, band_hash in enumerate(self.band_hashes(signature))])
+            self.db.commit()
+
+    def find_duplicate(self, name, tex_content):
+        """
+        Check a new document and index it if it is not a near-duplicate. A document
+        similar to the one indexed under the same name (e.g. a regenerated exercise) is
+        not a duplicate.
+
+        :param name: Unique name of the document, e.g. its path
+        :param tex_content: Content of the document
+        :return: Name of the indexed document it duplicates, or None if it was indexed
+        """
+        signature = self.signature(tex_content)
+        # The lookup and the insertion are atomic, two similar documents are not both indexed
+        with self.lock:
+            for match, _ in self.query(tex_content, signature):
+                if match != name:
+                    return match
+            self.add(name, tex_content, signature)
+        return None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,154 @@
+import csv
+import re
+import struct
+
+# Characters of the handwritten templates, used when a font file cannot be read
+UNICODE_CSV = "generate_font/Unicode_to_Character_Mapping.csv"
+
+# LaTeX syntax and command names, which are not typeset
+LATEX_SYNTAX_PATTERN = re.compile(r"(?<!\\)%[^\n]*|\\[a-zA-Z@]+\*?|\\.|[{}$&^_#~\\\s]", re.DOTALL)
+
+# Unicode cmap subtables, from the most to the least complete
+CMAP_SUBTABLES = [(3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)]
+
+def parse_cmap_format4(data, offset):
+    """Code points mapped to a glyph by a format 4 (BMP segments) subtable."""
+    seg_count = struct.unpack_from(">H", data, offset + 6)[0] // 2
+    ends_offset = offset + 14
+    starts_offset = ends_offset + 2 * seg_count + 2
+    deltas_offset = starts_offset + 2 * seg_count
+    range_offsets_offset = deltas_offset + 2 * seg_count
+    ends = struct.unpack_from(f">{seg_count}H", data, ends_offset)
+    starts = struct.unpack_from(f">{seg_count}H", data, starts_offset)
+    deltas = struct.unpack_from(f">{seg_count}H", data, deltas_offset)
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_offsets_offset)
+
+    code_points = set()
+    for i in range(seg_count):
+        start, end, delta, range_offset = starts[i], ends[i], deltas[i], range_offsets[i]
+        if start == 0xFFFF:
+            continue
+        for code_point in range(start, end + 1):
+            if range_offset == 0:
+                glyph = (code_point + delta) & 0xFFFF
+            else:
+                # The offset is relative to its own position in the idRangeOffset array
+                address = range_offsets_offset + 2 * i + range_offset + 2 * (code_point - start)
+                glyph = struct.unpack_from(">H", data, address)[0]
+                glyph = (glyph + delta) & 0xFFFF if glyph else 0
+            if glyph:
+                code_points.add(code_point)
+    return code_points
+
+def parse_cmap_format12(data, offset):
+    """Code points mapped to a glyph by a format 12 (segmented coverage) subtable."""
+    groups = struct.unpack_from(">I", data, offset + 12)[0]
+    code_points = set()
+    for group in range(groups):
+        start, end, start_glyph = struct.unpack_from(">III", data, offset + 16 + 12 * group)
+        code_points.update(range(start if start_glyph else start + 1, end + 1))
+    return code_points
+
+CMAP_PARSERS = {4: parse_cmap_format4, 12: parse_cmap_format12}
+
+def read_cmap(font_path):
+    """
+    Read the Unicode characters of a TrueType or OpenType font from its cmap table.
+
+    Args:
+        font_path (str): Path of a .ttf or .otf file.
+
+    Returns:
+        set of int: Code points with a glyph in the font.
+
+    Raises:
+        ValueError: If the font has no supported Unicode cmap subtable.
+    """
+    with open(font_path, "rb") as f:
+        data = f.read()
+
+    tables = struct.unpack_from(">H", data, 4)[0]
+    cmap_offset = None
+    for table in range(tables):
+        tag, _, offset, _ = struct.unpack_from(">4sIII", data, 12 + 16 * table)
+        if tag == b"cmap":
+            cmap_offset = offset
+            break
+    if cmap_offset is None:
+        raise ValueError(f"{font_path} has no cmap table")
+
+    subtables = {}
+    for subtable in range(struct.unpack_from(">H", data, cmap_offset + 2)[0]):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, cmap_offset + 4 + 8 * subtable)
+        subtables[(platform, encoding)] = cmap_offset + offset
+
+    for key in CMAP_SUBTABLES:
+        if key in subtables:
+            offset = subtables[key]
+            table_format = struct.unpack_from(">H", data, offset)[0]
+            if table_format in CMAP_PARSERS:
+                return CMAP_PARSERS[table_format](data, offset)
+    raise ValueError(f"{font_path} has no supported Unicode cmap subtable")
+
+def read_csv_coverage(csv_path=UNICODE_CSV):
+    """
+    Read the characters of a unicode,char mapping such as Unicode_to_Character_Mapping.csv.
+
+    Returns:
+        set of int: Code points listed in the file.
+    """
+    with open(csv_path, "r", encoding="utf-8") as f:
+        return {int(row["unicode"][2:], 16) for row in csv.DictReader(f)}
+
+def load_font_coverage(font_files, fallback_csv=UNICODE_CSV):
+    """
+    Load the characters covered by every font once.
+
+    Args:
+        font_files (dict): Font name (as in create_headers) to the path of its font file.
+        fallback_csv (str): Mapping used for the fonts whose file cannot be read.
+
+    Returns:
+        dict: Font name to the set of covered code points.
+    """
+    coverage = {}
+    for font, font_path in font_files.items():
+        try:
+            coverage[font] = read_cmap(font_path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not read the cmap of {font_path} ({e}), using {fallback_csv}")
+            coverage[font] = read_csv_coverage(fallback_csv)
+    return coverage
+
+def uncovered_characters(tex_content, code_points):
+    """
+    List the typeset characters of a document that a font lacks. Command names and
+    LaTeX syntax are ignored, the rest of the text and the math is checked.
+
+    Args:
+        tex_content (str): Content of a content.tex.
+        code_points (set of int): Characters of the font, see load_font_coverage.
+
+    Returns:
+        list of str: The missing characters, sorted.
+    """
+    text = LATEX_SYNTAX_PATTERN.sub("", tex_content)
+    return sorted(char for char in set(text) if ord(char) not in code_points)
+
+def fonts_to_skip(tex_content, font_coverage):
+    """
+    Find the fonts that cannot typeset a document without falling back to another font.
+
+    Args:
+        tex_content (str): Content of a content.tex.
+        font_coverage (dict): Result of load_font_coverage, fonts missing from it are not checked.
+
+    Returns:
+        dict: Font name to the list of its missing characters, for the fonts to skip.
+    """
+    skipped = {}
+    for font, code_points in font_coverage.items():
+        missing = uncovered_characters(tex_content, code_points)
+        if missing:
+            skipped[font] = missing
+    return skipped
@@ -1,22 +1,104 @@
+import asyncio
+import httpx
 import openai
 import os
+import time
 from dotenv import load_dotenv
 import random
+import threading
 from utils import ensure_raw_tex
+from stream_validator import EXERCISE_SEPARATOR, BatchStreamValidator, StreamValidator, validate_answer
+from tracing import TRACER
+
+# Errors after which a request is worth sending again, the httpx ones are raised while
+# reading the stream, e.g. when the connection drops in the middle of an answer
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.ReadError,
+    httpx.ReadTimeout,
+    httpx.RemoteProtocolError,
+)
+
+class RateLimiter:
+    def __init__(self, rate_per_minute):
+        """
+        Token bucket allowing rate_per_minute units (requests or tokens) per minute.
+
+        :param rate_per_minute: Number of units refilled per minute, also the bucket size
+        """
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """
+        Waits until amount units are available and takes them.
+
+        :param amount: Number of units to take, capped at the bucket size
+        """
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate)
+                self._refill()
+            self.available -= amount
+
+    def consume(self, amount):
+        """
+        Takes amount units without waiting, e.g. tokens only known after a response.
+        Later calls to acquire wait until the bucket is refilled.
+
+        :param amount: Number of units to take
+        """
+        self._refill()
+        self.available -= amount
 
 class LatexGenerator:
-    def __init__(self, api_key, languages=["English"], base_url="https://fmapi.swissai.cscs.ch", iterations=5):
+    def __init__(self, api_key, languages=["English"], base_url="https://fmapi.swissai.cscs.ch", iterations=5, model="meta-llama/Meta-Llama-3.1-70B-Instruct", cache=None, refresh=False, seed=None, max_attempts=3, max_answer_chars=20000, batch_size=1, dedup=None):
         """
         Initializes the LatexGenerator instance.
 
         :param api_key: API key
         :param languages: List of languages to use in the LaTeX document
-        :param base_url: API base URL
+        :param base_url: API base URL (any OpenAI-compatible server)
         :param iterations: Number of solutions to generate
+        :param model: Name of the chat model
+        :param cache: Optional ResponseCache reused across runs
+        :param refresh: Ignore the cached responses (new responses are still stored)
+        :param seed: Sampling seed, also makes the language of each exercise reproducible
+        :param max_attempts: Number of answers requested for an exercise before giving up,
+            when the previous answers are rejected (see StreamValidator)
+        :param max_answer_chars: Length after which an answer is rejected as a runaway
+        :param batch_size: Number of exercises requested in one completion
+        :param dedup: Optional DedupIndex, the near-duplicates of the exercises already
+            generated (also in previous runs) are not written
         """
         self.client = openai.Client(api_key=api_key, base_url=base_url)
+        self.api_key = api_key
+        self.base_url = base_url
+        # Client of the running event loop, see generate_latex_async
+        self.async_client = None
         self.iterations = iterations
         self.languages = languages
+        self.model = model
+        self.cache = cache
+        self.refresh = refresh
+        self.seed = seed
+        self.max_attempts = max_attempts
+        self.max_answer_chars = max_answer_chars
+        self.batch_size = batch_size
+        self.dedup = dedup
 
         self.header_template = f"""
         You should keep the simple default layout. You have to start your answer with the following structure for the LaTeX header:
@@ -33,48 +115,492 @@ class LatexGenerator:
         """
         return f"Answer only in latex format : give an example of a student solution to a math exercise number {exercise_number} with hard equations involving sqrt and power and a text explanation. the answer should be {answer}"
 
-    def generate_latex(self, output_dir="data/latex"):
+    def build_request(self, exercise_number):
         """
-        Generates LaTeX solutions for a series of math exercises and writes them to files.
+        Builds the full prompt for an exercise.
+
+        :param exercise_number: The exercise number
+        :return: The prompt sent to the model
         """
-        print(f"Generating LaTeX files... \nWaiting for LLM Response...") 
-        for i in range(1, self.iterations + 1):
-            question = self.generate_latex_question(i, i)
+        question = self.generate_latex_question(exercise_number, exercise_number)
+
+        rng = random if self.seed is None else random.Random(f"{self.seed}:{exercise_number}")
+        language = rng.choice(self.languages)
+        language_template = " Your answer has to be in " + language + " language. "
+
+        add_mistakes = "Strike through 1 realistic word mistake (not digit) if needed in the answer using the \\strikeMistake. All what you have to do is \\strikeMistake{a mistake}. "
 
-            language = random.choice(self.languages)
-            language_template = " Your answer has to be in " + language + " language. "
+        return question + language_template + add_mistakes + self.header_template
 
-            add_mistakes = "Strike through 1 realistic word mistake (not digit) if needed in the answer using the \\strikeMistake. All what you have to do is \\strikeMistake{a mistake}. "
+    def build_batch_request(self, exercise_numbers):
+        """
+        Builds one prompt asking for the documents of several exercises, separated by
+        EXERCISE_SEPARATOR lines.
+
+        :param exercise_numbers: The exercise numbers
+        :return: The prompt sent to the model
+        """
+        separator = EXERCISE_SEPARATOR.format("<number>")
+        instructions = (f"Answer with {len(exercise_numbers)} separate LaTeX documents, one for each of the following requests. "
+                        f"Before the document of each request, write the line {separator} with the number of the request and nothing else on that line.\n")
+        return instructions + "".join(f"\n{EXERCISE_SEPARATOR.format(n)}\n{self.build_request(n)}\n" for n in exercise_numbers)
 
-            request = question + language_template + add_mistakes + self.header_template
+    def exercise_batches(self):
+        """
+        Splits the exercises into the batches requested together.
+
+        :return: List of lists of exercise numbers
+        """
+        numbers = list(range(1, self.iterations + 1))
+        size = max(1, self.batch_size)
+        return [numbers[start:start + size] for start in range(0, len(numbers), size)]
+
+    def write_latex(self, answer, exercise_number, output_dir="data/latex"):
+        """
+        Writes a model answer as the content.tex of an exercise.
+
+        :param answer: The raw model answer
+        :param exercise_number: The exercise number
+        :param output_dir: Directory containing one subfolder per exercise
+        :return: Path of the written file, or None if the exercise is a near-duplicate
+        """
+        # Extract LaTeX content starting from the first LaTeX command
+        answer = ensure_raw_tex(answer)
 
-            res = self.client.chat.completions.create(
-                model="meta-llama/Meta-Llama-3.1-70B-Instruct",
-                messages=[
-                    {
-                        "content": request,
-                        "role": "user",
-                    }
-                ],
-                stream=True,
-            )
+        # Create the directory for the current iteration
+        directory = f"{output_dir}/{exercise_number}"
+        file_name = f'{directory}/content.tex'
 
-            answer = r""
+        if self.dedup is not None:
+            duplicate = self.dedup.find_duplicate(file_name, answer)
+            if duplicate is not None:
+                print(f"Dropped LaTeX {exercise_number}, near-duplicate of {duplicate}")
+                # A content.tex of a previous run would still be rendered
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+                return None
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Write the generated LaTeX to a file
+        with open(file_name, 'w') as f:
+            f.write(answer)
+
+        return file_name
+
+    def completion_kwargs(self, request, attempt=0):
+        """
+        Builds the arguments of a streaming chat completion.
+
+        :param request: The prompt
+        :param attempt: Number of rejected answers, changes the seed of the regenerated answers
+        :return: Keyword arguments for chat.completions.create
+        """
+        kwargs = {
+            "model": self.model,
+            "messages": [
+                {
+                    "content": request,
+                    "role": "user",
+                }
+            ],
+            "stream": True,
+        }
+        if self.seed is not None:
+            kwargs["seed"] = self.seed + attempt
+        return kwargs
+
+    def cached_answer(self, request, validate=True):
+        """
+        Looks up the answer of a request in the cache.
+
+        :param request: The prompt
+        :param validate: Ignore the cached answers rejected by StreamValidator
+        :return: (key, answer) where answer is None if it has to be requested
+        """
+        if self.cache is None:
+            return None, None
+        key = self.cache.make_key(self.model, request, self.seed)
+        if self.refresh:
+            return key, None
+        answer = self.cache.get(key)
+        # Answers cached before the validation was added may be rejected
+        if validate and answer is not None and validate_answer(answer, max_chars=self.max_answer_chars) is not None:
+            return key, None
+        return key, answer
+
+    def new_validator(self):
+        """Validator of the answer of one exercise."""
+        return StreamValidator(max_chars=self.max_answer_chars)
+
+    def stream_completion(self, request, attempt=0, new_validator=None):
+        """
+        Sends one streaming chat completion and checks the answer as it arrives. The request
+        is cancelled as soon as the answer is rejected or \\end{document} is received.
+
+        :param request: The prompt
+        :param attempt: Number of rejected answers, see completion_kwargs
+        :param new_validator: Function creating the validator, new_validator by default
+        :return: The validator, holding the answer (text) and the reason of a rejection (reason)
+        """
+        with TRACER.span("completion", "llm", attempt=attempt) as span:
+            res = self.client.chat.completions.create(**self.completion_kwargs(request, attempt))
+
+            validator = (new_validator or self.new_validator)()
             for chunk in res:
                 if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    answer += chunk.choices[0].delta.content
+                    if not validator.feed(chunk.choices[0].delta.content):
+                        # Closing the response stops the generation on the server
+                        res.close()
+                        break
+            span["success"] = validator.finish()
+            span["response_bytes"] = len(validator.text.encode("utf-8"))
+
+        return validator
+
+    def generate_exercise(self, exercise_number, output_dir="data/latex"):
+        """
+        Generates and writes the LaTeX solution of one exercise.
+
+        :param exercise_number: The exercise number
+        :param output_dir: Directory containing one subfolder per exercise
+        :return: Path of the written file, or None if every answer was rejected or a near-duplicate
+        """
+        with TRACER.span("generate_exercise", "llm", exercise=exercise_number) as span:
+            request = self.build_request(exercise_number)
+
+            key, answer = self.cached_answer(request)
+            cached = span["cached"] = answer is not None
+            # A near-duplicate answer is regenerated like a rejected one
+            for attempt in range(self.max_attempts):
+                span["retries"] = attempt
+                if answer is None:
+                    validator = self.stream_completion(request, attempt)
+                    if validator.reason is not None:
+                        print(f"Rejected LaTeX {exercise_number} ({validator.reason}), regenerating...")
+                        continue
+                    answer = validator.text
+                file_name = self.write_latex(answer, exercise_number, output_dir)
+                if file_name is not None:
+                    break
+                answer = None
+                cached = False
+            else:
+                print(f"Failed to generate LaTeX {exercise_number}: {self.max_attempts} answers rejected or near-duplicates")
+                span["success"] = False
+                return None
+            # Only the written answers are cached
+            if self.cache is not None and not cached:
+                self.cache.put(key, answer)
+            span["bytes_written"] = os.path.getsize(file_name)
+        print(f"Generated LaTeX {exercise_number}{' (cached)' if cached else ''}: {file_name}")
+        return file_name
+
+    def generate_latex(self, output_dir="data/latex"):
+        """
+        Generates LaTeX solutions for a series of math exercises and writes them to files.
+        """
+        print(f"Generating LaTeX files... \nWaiting for LLM Response...")
+        for exercise_numbers in self.exercise_batches():
+            if len(exercise_numbers) == 1:
+                self.generate_exercise(exercise_numbers[0], output_dir)
+            else:
+                self.generate_batch(exercise_numbers, output_dir)
+
+    def batch_answer(self, exercise_numbers):
+        """
+        Looks up the cached answer of a batch.
+
+        :param exercise_numbers: The exercise numbers of the batch
+        :return: (request, key, validator) where validator holds the replayed cached answer,
+            or is None if the answer has to be requested
+        """
+        request = self.build_batch_request(exercise_numbers)
+        key, answer = self.cached_answer(request, validate=False)
+        if answer is None:
+            return request, key, None
+        validator = BatchStreamValidator(exercise_numbers, max_chars=self.max_answer_chars)
+        validator.feed(answer)
+        validator.finish()
+        return request, key, validator
+
+    def write_batch(self, validator, key, output_dir, cached=False):
+        """
+        Writes the accepted documents of a batch and caches the answer if any was accepted.
+
+        :return: Dictionary mapping the exercise numbers to the written files
+        """
+        parts = validator.accepted_parts() if validator is not None else {}
+        if parts and not cached and self.cache is not None:
+            self.cache.put(key, validator.text)
+
+        file_names = {}
+        for exercise_number, answer in parts.items():
+            # The near-duplicates are left out, so they are generated again on their own
+            file_name = self.write_latex(answer, exercise_number, output_dir)
+            if file_name is not None:
+                file_names[exercise_number] = file_name
+                print(f"Generated LaTeX {exercise_number}{' (cached)' if cached else ''}: {file_name}")
+        if validator is not None:
+            for exercise_number, part in validator.parts.items():
+                if part.reason is not None:
+                    print(f"Rejected LaTeX {exercise_number} of the batch ({part.reason}), generating it on its own...")
+        return file_names
+
+    def generate_batch(self, exercise_numbers, output_dir="data/latex"):
+        """
+        Generates several exercises with one completion. The documents missing from the
+        answer or rejected are generated on their own with generate_exercise.
+
+        :param exercise_numbers: The exercise numbers
+        :param output_dir: Directory containing one subfolder per exercise
+        :return: List of the written files (None for the exercises that failed)
+        """
+        request, key, validator = self.batch_answer(exercise_numbers)
+        cached = validator is not None
+        if validator is None:
+            validator = self.stream_completion(request, new_validator=lambda: BatchStreamValidator(exercise_numbers, max_chars=self.max_answer_chars))
+
+        file_names = self.write_batch(validator, key, output_dir, cached)
+        for exercise_number in exercise_numbers:
+            if exercise_number not in file_names:
+                file_names[exercise_number] = self.generate_exercise(exercise_number, output_dir)
+        return [file_names[exercise_number] for exercise_number in exercise_numbers]
+
+    async def stream_completion_async(self, request, token_limiter=None, attempt=0, new_validator=None):
+        """
+        Sends one streaming chat completion and checks the answer as it arrives, see
+        stream_completion.
+
+        :param request: The prompt
+        :param token_limiter: Optional RateLimiter charged with the generated tokens
+        :param attempt: Number of rejected answers, see completion_kwargs
+        :param new_validator: Function creating the validator, new_validator by default
+        :return: The validator, holding the answer (text) and the reason of a rejection (reason)
+        """
+        res = await self.async_client.chat.completions.create(**self.completion_kwargs(request, attempt))
+
+        validator = (new_validator or self.new_validator)()
+        async for chunk in res:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                if not validator.feed(chunk.choices[0].delta.content):
+                    await res.close()
+                    break
+        validator.finish()
+
+        if token_limiter is not None:
+            # Streamed chunks carry about one token each
+            token_limiter.consume(len(validator.chunks))
+
+        return validator
+
+    async def request_answer_async(self, exercise_number, request, attempt, semaphore, request_limiter=None, token_limiter=None, max_retries=5, backoff=1.0, new_validator=None):
+        """
+        Requests one answer, retrying failed requests with exponential backoff.
+
+        :param exercise_number: The exercise number, or the range of a batch, for the messages and the trace
+        :param attempt: Number of rejected answers, see completion_kwargs
+        :param new_validator: Function creating the validator, new_validator by default
+        :return: The validator as stream_completion_async, None if every request failed
+        """
+        # The requests run concurrently on one thread, every exercise gets its own row in the trace
+        with TRACER.span("completion", "llm", exercise=exercise_number, attempt=attempt, tid=f"exercise {exercise_number}") as span:
+            async with semaphore:
+                for retry in range(max_retries + 1):
+                    span["retries"] = retry
+                    if request_limiter is not None:
+                        await request_limiter.acquire()
+                    if token_limiter is not None:
+                        # Rough estimate of the prompt size, about 4 characters per token
+                        await token_limiter.acquire(len(request) // 4)
+
+                    try:
+                        validator = await self.stream_completion_async(request, token_limiter, attempt, new_validator)
+                        break
+                    except RETRYABLE_ERRORS as e:
+                        if retry == max_retries:
+                            print(f"Failed to generate LaTeX {exercise_number}: {e}")
+                            span["success"] = False
+                            return None
+                        delay = backoff * 2 ** retry * random.uniform(0.5, 1.5)
+                        print(f"Request for LaTeX {exercise_number} failed ({e.__class__.__name__}), retrying in {delay:.1f}s...")
+                        await asyncio.sleep(delay)
+            span["response_bytes"] = len(validator.text.encode("utf-8"))
+            span["success"] = validator.reason is None
+        return validator
+
+    async def generate_exercise_async(self, exercise_number, output_dir, semaphore, request_limiter=None, token_limiter=None, max_retries=5, backoff=1.0):
+        """
+        Generates and writes one exercise, requesting a new answer when one is rejected or
+        is a near-duplicate.
+
+        :return: Path of the written file, or None if every attempt failed
+        """
+        request = self.build_request(exercise_number)
+
+        key, answer = self.cached_answer(request)
+        cached = answer is not None
+        # A near-duplicate answer is regenerated like a rejected one
+        for attempt in range(self.max_attempts):
+            if answer is None:
+                # The semaphore is released in between, so a rejected exercise waits behind the queued ones
+                validator = await self.request_answer_async(exercise_number, request, attempt, semaphore, request_limiter,
+                                                            token_limiter, max_retries, backoff)
+                if validator is None:
+                    return None
+                if validator.reason is not None:
+                    print(f"Rejected LaTeX {exercise_number} ({validator.reason}), queued for regeneration...")
+                    continue
+                answer = validator.text
+            file_name = self.write_latex(answer, exercise_number, output_dir)
+            if file_name is not None:
+                break
+            answer = None
+            cached = False
+        else:
+            print(f"Failed to generate LaTeX {exercise_number}: {self.max_attempts} answers rejected or near-duplicates")
+            return None
+
+        # Only the written answers are cached
+        if self.cache is not None and not cached:
+            self.cache.put(key, answer)
 
-            # Extract LaTeX content starting from the first LaTeX command
-            answer = ensure_raw_tex(answer)
+        print(f"Generated LaTeX {exercise_number}{' (cached)' if cached else ''}: {file_name}")
+        return file_name
 
-            # Create the directory for the current iteration
-            directory = f"{output_dir}/{i}"
-            os.makedirs(directory, exist_ok=True)
+    def new_async_client(self):
+        """
+        Client of the concurrent path, bound to the event loop it is first used on.
+        Retries are handled by request_answer_async.
+        """
+        return openai.AsyncClient(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+
+    async def generate_exercises_async(self, exercise_numbers, output_dir, semaphore, request_limiter=None, token_limiter=None, max_retries=5, backoff=1.0):
+        """
+        Generates one item of exercise_batches with generate_exercise_async or
+        generate_batch_async. An error that is not retried, e.g. a bad request, only fails
+        the exercises of the item.
+
+        :return: List of the written files (None for the exercises that failed)
+        """
+        args = (output_dir, semaphore, request_limiter, token_limiter, max_retries, backoff)
+        try:
+            if len(exercise_numbers) == 1:
+                return [await self.generate_exercise_async(exercise_numbers[0], *args)]
+            return await self.generate_batch_async(exercise_numbers, *args)
+        except Exception as e:
+            print(f"Failed to generate LaTeX {', '.join(map(str, exercise_numbers))}: {e}")
+            return [None] * len(exercise_numbers)
+
+    async def generate_latex_async(self, output_dir="data/latex", concurrency=8, requests_per_minute=None, tokens_per_minute=None, max_retries=5, backoff=1.0):
+        """
+        Generates LaTeX solutions with several requests in flight at the same time.
+
+        :param output_dir: Directory containing one subfolder per exercise
+        :param concurrency: Maximum number of requests in flight
+        :param requests_per_minute: Optional limit on the number of requests per minute
+        :param tokens_per_minute: Optional limit on the prompt and generated tokens per minute
+        :param max_retries: Number of retries of a failed request
+        :param backoff: Delay before the first retry in seconds, doubled on every retry
+        :return: List of the written files (None for the exercises that failed)
+        """
+        print(f"Generating LaTeX files with up to {concurrency} concurrent requests...")
+        semaphore = asyncio.Semaphore(concurrency)
+        request_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        token_limiter = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+
+        args = (output_dir, semaphore, request_limiter, token_limiter, max_retries, backoff)
+        # The client is closed before asyncio.run closes the loop it is bound to
+        async with self.new_async_client() as self.async_client:
+            results = await asyncio.gather(*[
+                self.generate_exercises_async(exercise_numbers, *args) for exercise_numbers in self.exercise_batches()
+            ])
+        self.async_client = None
+        return [file_name for result in results for file_name in result]
+
+    async def generate_batch_async(self, exercise_numbers, output_dir, semaphore, request_limiter=None, token_limiter=None, max_retries=5, backoff=1.0):
+        """
+        Generates several exercises with one completion, see generate_batch.
+
+        :return: List of the written files (None for the exercises that failed)
+        """
+        request, key, validator = self.batch_answer(exercise_numbers)
+        cached = validator is not None
+        if validator is None:
+            label = f"{exercise_numbers[0]}-{exercise_numbers[-1]}"
+            validator = await self.request_answer_async(label, request, 0, semaphore, request_limiter, token_limiter, max_retries, backoff,
+                                                        lambda: BatchStreamValidator(exercise_numbers, max_chars=self.max_answer_chars))
+
+        file_names = self.write_batch(validator, key, output_dir, cached)
+        missing = [exercise_number for exercise_number in exercise_numbers if exercise_number not in file_names]
+        retried = await asyncio.gather(*[
+            self.generate_exercises_async([exercise_number], output_dir, semaphore, request_limiter, token_limiter, max_retries, backoff)
+            for exercise_number in missing
+        ])
+        file_names.update(zip(missing, (result[0] for result in retried)))
+        return [file_names[exercise_number] for exercise_number in exercise_numbers]
+
+    def generate_latex_concurrent(self, output_dir="data/latex", **kwargs):
+        """
+        Runs generate_latex_async from synchronous code, see its parameters.
+        """
+        return asyncio.run(self.generate_latex_async(output_dir, **kwargs))
+
+class GenerationSession:
+    def __init__(self, generator, output_dir="data/latex", concurrency=8, requests_per_minute=None, tokens_per_minute=None, max_retries=5, backoff=1.0):
+        """
+        Event loop running in a background thread, on which other threads generate
+        exercises with generate_exercises_async. All the exercises share the semaphore,
+        the rate limiters and the retries of generate_latex_async, e.g. when the
+        generation stage of the streaming pipeline calls generate from its workers.
+
+        :param generator: The LatexGenerator
+        :param output_dir: Directory containing one subfolder per exercise
+        :param concurrency: Maximum number of requests in flight
+        :param requests_per_minute: Optional limit on the number of requests per minute
+        :param tokens_per_minute: Optional limit on the prompt and generated tokens per minute
+        :param max_retries: Number of retries of a failed request
+        :param backoff: Delay before the first retry in seconds, doubled on every retry
+        """
+        self.generator = generator
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="generation-loop", daemon=True)
+        self.thread.start()
+        self.args = self.run(self._open(output_dir, concurrency, requests_per_minute, tokens_per_minute, max_retries, backoff))
+
+    async def _open(self, output_dir, concurrency, requests_per_minute, tokens_per_minute, max_retries, backoff):
+        # The client, the semaphore and the limiters are bound to the loop they are created on
+        self.generator.async_client = self.generator.new_async_client()
+        semaphore = asyncio.Semaphore(concurrency)
+        request_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        token_limiter = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+        return output_dir, semaphore, request_limiter, token_limiter, max_retries, backoff
+
+    async def _close(self):
+        await self.generator.async_client.close()
+        self.generator.async_client = None
+
+    def run(self, coroutine):
+        """Runs a coroutine on the loop and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def generate(self, exercise_numbers):
+        """
+        Generates one item of exercise_batches, see generate_exercises_async.
+
+        :return: List of the written files (None for the exercises that failed)
+        """
+        return self.run(self.generator.generate_exercises_async(exercise_numbers, *self.args))
 
-            # Write the generated LaTeX to a file
-            file_name = f'{directory}/content.tex'
-            with open(file_name, 'w') as f:
-                f.write(answer)
+    def close(self):
+        """Closes the client and stops the loop."""
+        self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
 
-            print(f"Generated LaTeX {i}: {file_name}")
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,369 @@
+import os
+import re
+from os_utils import get_subfolders
+from tracing import TRACER
+
+# Commands defined by the LaTeX kernel, whether the LLM uses them in text or in math
+KERNEL_COMMANDS = """
+    section subsection subsubsection paragraph subparagraph item label ref pageref cite footnote caption
+    textbf textit textrm textsf texttt textup textsl textsc textmd textnormal emph underline
+    textsuperscript textsubscript bfseries itshape mdseries upshape slshape scshape rmfamily sffamily ttfamily
+    normalfont selectfont fontsize bf it rm sf tt em sc sl mbox makebox fbox framebox raisebox parbox rule
+    hbox vbox hskip vskip kern newline linebreak nolinebreak pagebreak newpage clearpage par noindent indent
+    centering raggedright raggedleft quad qquad hspace vspace hfill vfill hrulefill dotfill smallskip medskip
+    bigskip enskip enspace thinspace negthinspace nobreak allowbreak
+    tiny scriptsize footnotesize small normalsize large Large LARGE huge Huge
+    ldots dots today LaTeX LaTeXe TeX S P dag ddag copyright pounds textbackslash textasciitilde
+    textasciicircum textless textgreater textbar textendash textemdash textbullet textperiodcentered
+    textdegree texteuro textquoteleft textquoteright textquotedblleft textquotedblright
+    i j o O l L ae AE oe OE aa AA ss c d b H t u v r k
+    strut phantom hphantom vphantom relax hline vline cline multicolumn arraystretch tabcolsep
+    setlength addtolength setcounter stepcounter arabic roman Roman alph Alph the value cr noalign
+    newcommand renewcommand providecommand newenvironment renewenvironment def let
+    displaystyle textstyle scriptstyle scriptscriptstyle ensuremath boldmath unboldmath
+    mathbf mathrm mathit mathsf mathtt mathcal mathnormal mathop mathrel mathbin mathord mathopen
+    mathclose mathpunct mathstrut limits nolimits displaylimits over atop choose not vcenter
+    frac sqrt root overline underline overbrace underbrace stackrel buildrel
+    left right big Big bigg Bigg bigl bigr Bigl Bigr biggl biggr bigm Bigm biggm Biggm Biggl Biggr
+    alpha beta gamma delta epsilon varepsilon zeta eta theta vartheta iota kappa lambda mu nu xi
+    pi varpi rho varrho sigma varsigma tau upsilon phi varphi chi psi omega
+    Gamma Delta Theta Lambda Xi Pi Sigma Upsilon Phi Psi Omega
+    aleph hbar imath jmath ell wp Re Im partial infty prime emptyset nabla surd top bot angle triangle
+    backslash forall exists neg lnot flat natural sharp clubsuit diamondsuit heartsuit spadesuit
+    sum prod coprod int oint bigcap bigcup bigsqcup bigvee bigwedge bigodot bigotimes bigoplus biguplus
+    pm mp times div ast star circ bullet cdot cap cup uplus sqcap sqcup vee wedge lor land setminus wr
+    diamond bigtriangleup bigtriangledown triangleleft triangleright oplus ominus otimes oslash odot
+    bigcirc dagger ddagger amalg
+    leq le geq ge neq ne equiv prec succ sim preceq succeq simeq ll gg asymp subset supset approx
+    subseteq supseteq cong sqsubseteq sqsupseteq bowtie in ni notin propto vdash dashv models doteq
+    smile frown mid parallel perp
+    leftarrow gets rightarrow to leftrightarrow Leftarrow Rightarrow Leftrightarrow longleftarrow
+    longrightarrow longleftrightarrow Longleftarrow Longrightarrow Longleftrightarrow mapsto longmapsto
+    hookleftarrow hookrightarrow leftharpoonup leftharpoondown rightharpoonup rightharpoondown
+    rightleftharpoons iff uparrow downarrow updownarrow Uparrow Downarrow Updownarrow nearrow searrow
+    swarrow nwarrow
+    lbrace rbrace langle rangle lfloor rfloor lceil rceil vert Vert lgroup rgroup lmoustache rmoustache
+    arrowvert Arrowvert bracevert
+    cdots vdots ddots hat check breve acute grave tilde bar vec dot ddot widehat widetilde
+    overrightarrow overleftarrow
+    arccos arcsin arctan arg cos cosh cot coth csc deg det dim exp gcd hom inf ker lg lim liminf limsup
+    ln log max min Pr sec sin sinh sup tan tanh bmod pmod
+"""
+
+# Commands added by the packages of the headers (amsmath with amsbsy, tikz, xcolor,
+# fontspec, mathspec, xparse) and by the headers themselves, see create_headers
+PACKAGE_COMMANDS = """
+    text dfrac tfrac cfrac genfrac binom dbinom tbinom overset underset sideset boxed tag notag nonumber
+    intertext substack eqref operatorname DeclareMathOperator iint iiint iiiint idotsint xrightarrow
+    xleftarrow dddot ddddot lvert rvert lVert rVert implies impliedby dotsc dotsb dotsm dotsi dotso
+    mod pod numberwithin allowdisplaybreaks displaybreak smash hdotsfor injlim projlim varinjlim
+    varprojlim varliminf varlimsup varGamma varDelta varTheta varLambda varXi varPi varSigma varUpsilon
+    varPhi varPsi varOmega colon
+    boldsymbol pmb
+    tikz usetikzlibrary draw node fill filldraw path shade shadedraw clip coordinate foreach
+    pgfmathsetmacro pgfmathparse
+    color textcolor colorbox fcolorbox pagecolor definecolor
+    setmainfont newfontfamily fontspec NewDocumentCommand
+    strikeMistake processtext irregularword scaledsqrt sqrtoverline
+"""
+
+KNOWN_COMMANDS = frozenset((KERNEL_COMMANDS + PACKAGE_COMMANDS).split())
+
+KNOWN_ENVIRONMENTS = frozenset("""
+    document center flushleft flushright itemize enumerate description list trivlist minipage quote
+    quotation verse tabbing tabular tabular* array figure table picture verbatim math displaymath
+    equation eqnarray eqnarray* equation* align align* alignat alignat* flalign flalign* gather gather*
+    multline multline* split aligned alignedat gathered cases subequations
+    matrix pmatrix bmatrix Bmatrix vmatrix Vmatrix smallmatrix tikzpicture scope
+""".split())
+
+# Environments typeset in math mode
+MATH_ENVIRONMENTS = frozenset("""
+    math displaymath equation equation* eqnarray eqnarray* align align* alignat alignat* flalign flalign*
+    gather gather* multline multline*
+""".split())
+
+# Commands only allowed in math mode, xelatex inserts a $ before them in text mode
+MATH_COMMANDS = frozenset("""
+    frac dfrac tfrac sqrt sum prod int lim leq geq neq approx times cdot pm infty partial
+    alpha beta gamma delta epsilon theta lambda mu pi sigma phi omega
+""".split())
+
+# Commands whose argument is typeset in text mode, also inside math
+TEXT_COMMANDS = frozenset("text textbf textit textrm textsf texttt textup textnormal mbox hbox fbox emph strikeMistake".split())
+
+# Commands whose argument is a key or verbatim-like text, where _ and ^ are not scripts
+RAW_ARGUMENT_COMMANDS = frozenset("label ref pageref eqref cite texttt".split())
+
+# Closing delimiter of every math opener
+MATH_CLOSERS = {"$": "$", "$$": "$$", "\\(": "\\)", "\\[": "\\]"}
+
+# Commands and environments defined in the document itself
+DEFINITION_PATTERN = re.compile(r"\\(?:(?:re)?newcommand|providecommand|DeclareMathOperator)\*?\s*\{?\\([a-zA-Z]+)|\\def\s*\\([a-zA-Z]+)")
+ENVIRONMENT_DEFINITION_PATTERN = re.compile(r"\\(?:re)?newenvironment\s*\{([^}]*)\}")
+
+TOKEN_PATTERN = re.compile(
+    r"(?P<comment>%[^\n]*)"
+    r"|\\begin\s*\{(?P<begin>[^}]*)\}"
+    r"|\\end\s*\{(?P<end>[^}]*)\}"
+    r"|\\(?P<command>[a-zA-Z@]+)\*?"
+    r"|\\(?P<symbol>.)"
+    r"|(?P<dollar>\$\$?)"
+    r"|(?P<brace>[{}])"
+    r"|(?P<script>[\^_])"
+    r"|(?P<paragraph>\n[ \t]*\n)",
+    re.DOTALL,
+)
+
+class LatexLinter:
+    def __init__(self, known_commands=KNOWN_COMMANDS, known_environments=KNOWN_ENVIRONMENTS):
+        """
+        Structural check of the generated documents, without running xelatex.
+
+        Checks the balance of the braces and environments, the math delimiters and the
+        nested \\strikeMistake, which xelatex cannot get past. Along with these problems,
+        scan lists the edits repairing them. The commands and environments missing from
+        the whitelists and the math used in text mode are only reported as warnings.
+
+        :param known_commands: Names of the allowed commands, without backslash
+        :param known_environments: Names of the allowed environments
+        """
+        self.known_commands = known_commands
+        self.known_environments = known_environments
+
+    def scan(self, tex_content):
+        """
+        Lint a document.
+
+        :param tex_content: Content of a content.tex, from \\begin{document} to \\end{document}
+        :return: (problems, edits) where problems are messages and edits are
+            (start, end, replacement) tuples repairing some of the problems, the warnings
+            are left in the warnings attribute
+        """
+        self.tex = tex_content
+        self.problems = []
+        self.warnings = []
+        self.edits = []
+        # Open braces and environments, with the math mode inside them and around them
+        self.stack = []
+        self.math = None
+        pending_text = False
+        pending_strike = False
+        pending_raw = False
+        strike_depth = 0
+        raw_depth = 0
+
+        known_commands = self.known_commands | {match.group(1) or match.group(2) for match in DEFINITION_PATTERN.finditer(tex_content)}
+        known_environments = self.known_environments | set(ENVIRONMENT_DEFINITION_PATTERN.findall(tex_content))
+
+        for match in TOKEN_PATTERN.finditer(tex_content):
+            kind = match.lastgroup
+            value = match.group(kind)
+            start, end = match.span()
+
+            if kind == "command":
+                if value not in known_commands:
+                    self.warning(start, f"unknown command \\{value}")
+                elif value in MATH_COMMANDS and self.math is None:
+                    self.warning(start, f"\\{value} outside math mode")
+                if value == "strikeMistake":
+                    if strike_depth > 0:
+                        # The inner argument stays as a plain group
+                        self.problem(start, "nested \\strikeMistake", (start, end, ""))
+                    else:
+                        pending_strike = True
+                pending_text = value in TEXT_COMMANDS
+                pending_raw = value in RAW_ARGUMENT_COMMANDS
+                continue
+
+            if kind == "brace" and value == "{":
+                entry = {"kind": "{", "start": start, "saved_math": self.math, "strike": pending_strike, "raw": pending_raw}
+                if pending_text:
+                    self.math = None
+                entry["math"] = self.math
+                self.stack.append(entry)
+                strike_depth += 1 if pending_strike else 0
+                raw_depth += 1 if pending_raw else 0
+                pending_text = pending_strike = pending_raw = False
+                continue
+            # The argument of a text command is the next token if it is not a group
+            pending_text = pending_strike = pending_raw = False
+
+            if kind == "brace":
+                if not self.stack or self.stack[-1]["kind"] != "{":
+                    self.problem(start, "unmatched }", (start, end, ""))
+                    continue
+                strike_depth -= 1 if self.stack[-1]["strike"] else 0
+                raw_depth -= 1 if self.stack[-1]["raw"] else 0
+                self.close(len(self.stack) - 1, start)
+            elif kind == "begin":
+                if value not in known_environments:
+                    self.warning(start, f"unknown environment {value}")
+                entry = {"kind": value, "start": start, "saved_math": self.math, "strike": False, "raw": False}
+                if value in MATH_ENVIRONMENTS:
+                    if self.math is not None:
+                        self.problem(start, f"\\begin{{{value}}} inside math mode")
+                    self.math = value
+                entry["math"] = self.math
+                self.stack.append(entry)
+            elif kind == "end":
+                depth = next((i for i in range(len(self.stack) - 1, -1, -1) if self.stack[i]["kind"] == value), None)
+                if depth is None:
+                    self.problem(start, f"\\end{{{value}}} without \\begin{{{value}}}", (start, end, ""))
+                    continue
+                strike_depth -= sum(1 for entry in self.stack[depth:] if entry["strike"])
+                raw_depth -= sum(1 for entry in self.stack[depth:] if entry["raw"])
+                self.close(depth, start)
+                if value == "document":
+                    break
+            elif kind == "dollar" or (kind == "symbol" and value in "()[]"):
+                delimiter = value if kind == "dollar" else "\\" + value
+                if delimiter.startswith("$") and self.math == delimiter:
+                    self.math = None
+                elif delimiter == "$$" and self.math == "$":
+                    # In inline math TeX reads $$ as a closing $ followed by an opening one
+                    self.math_start = start + 1
+                elif delimiter in MATH_CLOSERS and self.math is None:
+                    self.math = delimiter
+                    self.math_start = start
+                elif delimiter in MATH_CLOSERS:
+                    self.problem(start, f"{delimiter} inside math mode", (start, end, ""))
+                else:
+                    opener = {"\\)": "\\(", "\\]": "\\["}[delimiter]
+                    if self.math == opener:
+                        self.math = None
+                    else:
+                        self.problem(start, f"{delimiter} without {opener}", (start, end, ""))
+            elif kind == "script":
+                if self.math is None and raw_depth == 0:
+                    self.warning(start, f"{value} outside math mode")
+            elif kind == "paragraph":
+                if self.math == "$$":
+                    # Where the display was meant to end is unknown, the document is rejected
+                    self.problem(self.math_start, "$$ not closed before the end of the paragraph")
+                    self.math = None
+                elif self.math in MATH_CLOSERS:
+                    # The groups opened in math mode are closed first
+                    depth = next((i for i, entry in enumerate(self.stack) if entry["start"] > self.math_start), len(self.stack))
+                    self.close(depth, start, closed_by_token=False)
+                    self.problem(self.math_start, f"{self.math} not closed before the end of the paragraph",
+                                 (start, start, MATH_CLOSERS[self.math]))
+                    self.math = None
+        else:
+            # No \end{document}, everything still open is closed at the end
+            self.close(0, len(tex_content), closed_by_token=False)
+            if self.math in MATH_CLOSERS:
+                self.problem(self.math_start, f"{self.math} not closed", (len(tex_content), len(tex_content), MATH_CLOSERS[self.math]))
+
+        return self.problems, self.edits
+
+    def problem(self, position, message, edit=None):
+        line = self.tex.count("\n", 0, position) + 1
+        self.problems.append(f"line {line}: {message}")
+        if edit is not None:
+            self.edits.append(edit)
+
+    def warning(self, position, message):
+        line = self.tex.count("\n", 0, position) + 1
+        self.warnings.append(f"line {line}: {message}")
+
+    @staticmethod
+    def describe(entry):
+        return "{" if entry["kind"] == "{" else f"\\begin{{{entry['kind']}}}"
+
+    def close(self, depth, position, closed_by_token=True):
+        """
+        Pop the entries of the stack down to depth. The one at depth is closed by the
+        current token, the ones above it are reported and closed by inserted code.
+        """
+        while len(self.stack) > depth:
+            entry = self.stack.pop()
+            if self.math != entry["math"] and self.math in MATH_CLOSERS:
+                self.problem(self.math_start, f"{self.math} not closed before the end of {self.describe(entry)}",
+                             (position, position, MATH_CLOSERS[self.math]))
+            if len(self.stack) > depth or not closed_by_token:
+                self.problem(entry["start"], f"{self.describe(entry)} not closed",
+                             (position, position, "}" if entry["kind"] == "{" else f"\\end{{{entry['kind']}}}"))
+            self.math = entry["saved_math"]
+
+def apply_edits(tex_content, edits):
+    """Apply (start, end, replacement) edits, the edits at the same position in order."""
+    pieces = []
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0]):
+        if start < position:
+            continue
+        pieces.append(tex_content[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(tex_content[position:])
+    return "".join(pieces)
+
+def lint_tex(tex_content, linter=None):
+    """
+    Lint a document, see LatexLinter.
+
+    Returns:
+        list of str: The problems xelatex cannot get past, empty if the document looks
+        compilable.
+    """
+    return (linter or LatexLinter()).scan(tex_content)[0]
+
+def repair_tex(tex_content, linter=None):
+    """
+    Repair the unbalanced delimiters and the nested \\strikeMistake of a document.
+
+    Returns:
+        tuple: (repaired content, problems left after the repair)
+    """
+    linter = linter or LatexLinter()
+    problems, edits = linter.scan(tex_content)
+    if not problems:
+        return tex_content, []
+    repaired = apply_edits(tex_content, edits)
+    return repaired, linter.scan(repaired)[0]
+
+def lint_file(content_path, linter=None):
+    """
+    Lint a content.tex, repair it once if needed, or rename it to content.tex.rejected
+    so that add_headers skips it.
+
+    Returns:
+        str: "ok", "repaired" or "rejected".
+    """
+    with open(content_path, "r", encoding="utf-8") as f:
+        tex_content = f.read()
+    linter = linter or LatexLinter()
+    problems = lint_tex(tex_content, linter)
+    if linter.warnings:
+        print(f"Warnings for {content_path}: {'; '.join(linter.warnings[:3])}")
+    if not problems:
+        return "ok"
+
+    repaired, remaining = repair_tex(tex_content, linter)
+    if not remaining:
+        with open(content_path, "w", encoding="utf-8") as f:
+            f.write(repaired)
+        return "repaired"
+
+    print(f"Rejected {content_path}: {'; '.join(remaining[:3])}")
+    os.replace(content_path, content_path + ".rejected")
+    return "rejected"
+
+@TRACER.traced()
+def lint_latex(tex_dir="data/latex"):
+    """
+    Lint the content.tex of every exercise before the headers are added, see lint_file.
+
+    Returns:
+        dict: Number of files per outcome ("ok", "repaired", "rejected").
+    """
+    print("Linting LaTeX files...")
+    linter = LatexLinter()
+    outcomes = {"ok": 0, "repaired": 0, "rejected": 0}
+    for folder in get_subfolders(tex_dir):
+        content_path = os.path.join(tex_dir, folder, "content.tex")
+        if os.path.exists(content_path):
+            outcomes[lint_file(content_path, linter)] += 1
+    print(f"Linted {sum(outcomes.values())} files: {outcomes['ok']} ok, {outcomes['repaired']} repaired, {outcomes['rejected']} rejected.")
+    return outcomes
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+
+class ResponseCache:
+    def __init__(self, cache_dir="data/cache", max_bytes=1 << 30):
+        """
+        Persistent on-disk cache of LLM responses, addressed by a hash of the request.
+
+        The least recently used responses are evicted once the cache grows over max_bytes.
+
+        :param cache_dir: Directory where the responses are stored
+        :param max_bytes: Maximum total size of the stored responses
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # The generation threads of the streaming pipeline share the size bookkeeping
+        self.lock = threading.RLock()
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    @staticmethod
+    def make_key(model, prompt, seed=None):
+        """
+        Builds the cache key of a request.
+
+        :param model: Name of the model
+        :param prompt: Full prompt sent to the model
+        :param seed: Sampling seed of the request
+        :return: Hex digest identifying the request
+        """
+        payload = json.dumps([model, prompt, seed], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".txt")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".txt"):
+                    yield os.path.join(root, file)
+
+    def get(self, key):
+        """
+        Returns the cached response of a request, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                response = f.read()
+        except FileNotFoundError:
+            return None
+
+        # The modification time tracks the last use for the eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread in the meantime
+            pass
+        return response
+
+    def put(self, key, response):
+        """
+        Stores the response of a request and evicts old responses if needed.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(response)
+            os.replace(tmp_path, path)
+
+            self.size += os.path.getsize(path) - previous_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the cache fits in max_bytes.
+        """
+        with self.lock:
+            entries = sorted(self._entries(), key=os.path.getmtime)
+            for path in entries:
+                if self.size <= self.max_bytes:
+                    break
+                self.size -= os.path.getsize(path)
+                os.remove(path)
@@ -1,5 +1,17 @@
+import argparse
 import os
+import random
+import shutil
 from latex_generator import LatexGenerator
+from llm_cache import ResponseCache
+from build_manifest import BuildManifest
+from pipeline import run_streaming_pipeline
+from dataset_writer import write_dataset_shards
+from tensor_store import export_tensor_store
+from latex_lint import lint_latex
+from glyph_coverage import load_font_coverage
+from dedup import DedupIndex
+from tracing import TRACER
 from utils import *
 from dotenv import load_dotenv
 
@@ -14,28 +26,191 @@ fonts = ["ML4Science", "JaneAusten"]
 pagecolors = ["white", "paper"]
 textcolors = ["black", "darkblue", "red"]
 
+# Font files whose characters are checked before compiling, an exercise is not rendered
+# with a font lacking some of its characters (set to None to render every pair)
+font_files = {
+    "ML4Science": "generate_font/fonts/ML4Science.otf",
+    "JaneAusten": "generate_font/fonts/JaneAust.ttf",
+}
+
+# Number of LLM requests in flight at the same time and optional rate limits (None for no limit)
+generation_concurrency = 8
+requests_per_minute = None
+tokens_per_minute = None
+
+# Number of exercises requested in one LLM completion (1 for one request per exercise)
+generation_batch_size = 1
+
+# Cache of the LLM responses, reused when the same prompt is sent again
+cache_dir = "data/cache"
+cache_max_bytes = 1 << 30
+
+# Index of the generated exercises, kept across runs, whose near-duplicates (estimated
+# similarity above dedup_threshold) are dropped before rendering (set to None to keep all)
+dedup_path = "data/dedup.sqlite"
+dedup_threshold = 0.8
+
+# Record of the inputs of every compile, raster and augment step for incremental builds
+manifest_path = "data/manifest.json"
+
+# Check the generated LaTeX before adding the headers, repairing the unbalanced delimiters
+# and skipping the documents that would still fail to compile
+lint_generated_latex = True
+
+# "tikz" lets xelatex shift and rotate every word, "python" precomputes it in the TeX source
+irregularity_engine = "tikz"
+
+# Seed of the LLM sampling and of the irregularities drawn in Python
+# (None for a different result on every run)
+seed = None
+
+# Resolution of the generated PNGs
+dpi = 500
+
+# Number of xelatex processes to run in parallel
+compile_workers = os.cpu_count() or 1
+
+# Seconds after which a xelatex process is killed (None for no limit)
+compile_timeout = 120
+
+# Number of processes adding noise and blur to the PNGs
+augment_workers = os.cpu_count() or 1
+
+# Directory where one precompiled xelatex format per distinct preamble is stored
+# (set to None to load every package on each compilation)
+formats_dir = "data/formats"
+
+# Number of exercises compiled together in one multi-page document per header variant
+# (set to None to compile every exercise on its own)
+batch_size = None
+batch_dir = "data/batches"
+
+# Compile black text on white pages only and derive the other colors from the PNGs
+raster_colors = False
+
+# Compile without grid and draw the grid on the PNGs instead
+raster_grid = False
+
+# The grid of the headers would be recolored like the text, so with raster_colors the
+# grid is always drawn on the recolored PNGs
+raster_grid = raster_grid or raster_colors
+
+# Augment the rendered pages in memory instead of writing the PNGs and decoding them again
+# (only without batch_size), and whether to write the PNGs without noise and blur too
+in_memory_raster = False
+write_clean_pngs = True
+
+# Stack the PNGs resized to tensor_shape (height, width) in a memory-mapped array for training
+# (set to None to skip the export)
+tensor_store_path = None
+tensor_shape = (512, 512)
+
+# Pack the PNGs, their LaTeX source and attributes into tar shards of at most shard_max_bytes
+# (set to None to keep the PNG files only), and delete the PNGs once they are packed
+shard_dir = None
+shard_max_bytes = 1 << 30
+delete_packed_pngs = False
+
+# Run all the stages at the same time, each exercise flowing through them as soon as it
+# is generated, with at most queue_size items waiting between two stages
+streaming = False
+queue_size = 64
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic handwritten math exercises.")
+    parser.add_argument("--refresh", action="store_true", help="Request new LLM responses instead of using the cached ones")
+    parser.add_argument("--incremental", action="store_true", help="Keep the intermediate files and only redo the steps whose inputs changed (use a fixed seed)")
+    parser.add_argument("--trace", metavar="PATH", help="Write a Chrome trace of the stages, commands and LLM requests to PATH and a metrics summary next to it")
+    args = parser.parse_args()
+
+    if args.trace:
+        TRACER.enable()
+
+    # The strike designs of the headers are drawn at random
+    if seed is not None:
+        random.seed(seed)
+    manifest = BuildManifest(manifest_path) if args.incremental else None
+
     # Load the API key from the .env file
     load_dotenv()
     api_key = os.getenv("API_KEY")
 
-    # Generate the LaTeX scripts
-    generator = LatexGenerator(api_key, languages=languages, iterations=nbr_of_texfiles)
-    generator.generate_latex(latex_dir)
+    cache = ResponseCache(cache_dir, max_bytes=cache_max_bytes)
+    dedup = DedupIndex(dedup_path, threshold=dedup_threshold) if dedup_path else None
+    generator = LatexGenerator(api_key, languages=languages, iterations=nbr_of_texfiles, cache=cache, refresh=args.refresh, seed=seed,
+                              batch_size=generation_batch_size, dedup=dedup)
+
+    font_coverage = load_font_coverage(font_files) if font_files else None
+
+    if raster_colors:
+        headers, paths = create_headers(fonts, ["white"], ["black"], grid=not raster_grid)
+    else:
+        headers, paths = create_headers(fonts, pagecolors, textcolors, grid=not raster_grid)
+
+    if streaming:
+        run_streaming_pipeline(generator, headers, paths, latex_dir=latex_dir, generated_dir=generated_dir,
+                               queue_size=queue_size, generation_workers=generation_concurrency,
+                               compile_workers=compile_workers, dpi=dpi, irregularity_engine=irregularity_engine,
+                               seed=seed, fmt_dir=formats_dir, textcolors=textcolors if raster_colors else None,
+                               pagecolors=pagecolors, raster_grid=raster_grid, in_memory=in_memory_raster,
+                               write_clean=write_clean_pngs, compile_timeout=compile_timeout, lint=lint_generated_latex,
+                               font_coverage=font_coverage, requests_per_minute=requests_per_minute,
+                               tokens_per_minute=tokens_per_minute)
+    else:
+        # Generate the LaTeX scripts
+        generator.generate_latex_concurrent(latex_dir, concurrency=generation_concurrency, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+
+        # Repair or reject the LaTeX scripts that would fail to compile
+        if lint_generated_latex:
+            lint_latex(tex_dir=latex_dir)
+
+        # Add headers to the LaTeX scripts
+        add_headers(tex_dir=latex_dir, headers=headers, paths=paths, irregularity_engine=irregularity_engine, seed=seed, font_coverage=font_coverage)
+
+        if batch_size:
+            # Compile the exercises in batches and split the pages into PNGs
+            create_batches(tex_dir=latex_dir, batch_dir=batch_dir, batch_size=batch_size)
+            convert_batches_to_pngs(batch_dir=batch_dir, output_dir=generated_dir, dpi=dpi, workers=compile_workers, fmt_dir=formats_dir, timeout=compile_timeout)
+        else:
+            # Convert the LaTeX scripts to PDFs
+            convert_tex_to_pdf(input_dir=latex_dir, ouptur_dir=generated_dir, workers=compile_workers, fmt_dir=formats_dir, manifest=manifest, timeout=compile_timeout)
+
+        if in_memory_raster and not batch_size:
+            # Render, derive and augment every PDF in memory
+            rasterize_and_augment_pdfs(input_dir=generated_dir, dpi=dpi, textcolors=textcolors if raster_colors else None,
+                                       pagecolors=pagecolors, raster_grid=raster_grid, write_clean=write_clean_pngs,
+                                       workers=augment_workers, seed=seed, manifest=manifest)
+        else:
+            if not batch_size:
+                # Convert the PDFs to PNGs
+                convert_pdf_to_pngs(input_dir=generated_dir, dpi=dpi, manifest=manifest)
+
+            if raster_colors:
+                derive_color_variants(directory=generated_dir, textcolors=textcolors, pagecolors=pagecolors)
+
+            if raster_grid:
+                add_grid_variants(directory=generated_dir, dpi=dpi)
 
-    # Add headers to the LaTeX scripts
-    headers, paths = create_headers(fonts, pagecolors, textcolors)
-    add_headers(tex_dir=latex_dir, headers=headers, paths=paths)
+            # Generate noisy and blurred images
+            add_noise_and_blur(directory=generated_dir, manifest=manifest, workers=augment_workers, seed=seed)
 
-    # Convert the LaTeX scripts to PDFs
-    convert_tex_to_pdf(input_dir=latex_dir, ouptur_dir=generated_dir)
+        if manifest is not None:
+            # The intermediate files are the inputs of the next incremental build
+            manifest.save()
+        else:
+            # Clean up the directories
+            delete_pdfs(pdf_dir=generated_dir)
+            clean_tex_headers(tex_dir=latex_dir)
+        if batch_size:
+            shutil.rmtree(batch_dir, ignore_errors=True)
 
-    # Convert the PDFs to PNGs
-    convert_pdf_to_pngs(input_dir=generated_dir)
+    if tensor_store_path is not None:
+        export_tensor_store(generated_dir=generated_dir, store_path=tensor_store_path, shape=tensor_shape, workers=augment_workers)
 
-    # Generate noisy and blurred images
-    add_noise_and_blur(directory=generated_dir)
+    if shard_dir is not None:
+        write_dataset_shards(generated_dir=generated_dir, latex_dir=latex_dir, output_dir=shard_dir,
+                             max_shard_bytes=shard_max_bytes, delete_pngs=delete_packed_pngs)
 
-    # Clean up the directories
-    delete_pdfs(pdf_dir=generated_dir)
-    clean_tex_headers(tex_dir=latex_dir)
+    if args.trace:
+        TRACER.export_chrome_trace(args.trace)
+        TRACER.write_summary(os.path.splitext(args.trace)[0] + "_metrics.json")
@@ -1,12 +1,71 @@
 import os
+import resource
+import shlex
+import signal
 import subprocess
+from tracing import TRACER
 
-def run_command(command):
-    """Run a shell command with error handling."""
-    try:
-        subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError as e:
-        return
+def run_process(command, env=None, timeout=None):
+    """
+    Run a command without a shell, in its own process group so that the command and
+    all its children are killed if it runs for longer than timeout.
+
+    Args:
+        command (list of str or str): Arguments of the command (a string is split like a shell would).
+        env (dict): Extra environment variables.
+        timeout (float): Maximum duration in seconds (None for no limit).
+
+    Returns:
+        str: "ok", "failed" (non-zero exit code or command not found) or "timeout".
+    """
+    if isinstance(command, str):
+        command = shlex.split(command)
+    if env is not None:
+        env = {**os.environ, **env}
+
+    with TRACER.span(os.path.basename(command[0]), "command", command=" ".join(command)) as span:
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                       errors="replace", env=env, start_new_session=True)
+        except OSError:
+            span["success"] = False
+            return "failed"
+
+        try:
+            process.communicate(timeout=timeout)
+            status = "ok" if process.returncode == 0 else "failed"
+        except subprocess.TimeoutExpired:
+            status = "timeout"
+        except BaseException:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            raise
+        finally:
+            # Approximate when other threads run commands at the same time
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            span["cpu_seconds"] = (children_end.ru_utime + children_end.ru_stime
+                                   - children_start.ru_utime - children_start.ru_stime)
+
+        if status == "timeout":
+            # Kill the whole group, xelatex may have started other processes
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.communicate()
+        span["success"] = status == "ok"
+        span["status"] = status
+    return status
+
+def run_command(command, env=None, timeout=None):
+    """
+    Run a command with error handling, optionally with extra environment variables.
+
+    Returns:
+        bool: Whether the command succeeded (see run_process).
+    """
+    return run_process(command, env, timeout) == "ok"
 
 def check_file_exists(filename):
     """Check if a file exists."""
@@ -0,0 +1,213 @@
+import os
+import queue
+import threading
+import time
+from utils import *
+from compile_watchdog import COMPILE_STATS
+from latex_lint import lint_file
+from latex_generator import GenerationSession
+
+# Marks the end of the items flowing through a queue
+STOP = object()
+
+class StreamingStage:
+    def __init__(self, name, func, in_queue, out_queue=None, workers=1):
+        """
+        Pipeline stage applying func to every item of in_queue with a pool of threads.
+
+        func returns the list of items passed on to out_queue (fan-out is allowed, an
+        empty list drops the item). Since out_queue is bounded, the stage blocks when the
+        next stage falls behind.
+
+        :param name: Name of the stage in the progress messages
+        :param func: Function processing one item
+        :param in_queue: Queue the items are taken from
+        :param out_queue: Queue the results are put in (None for the last stage)
+        :param workers: Number of threads running func
+        """
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.processed = 0
+        self.failed = 0
+        self.first_output_time = None
+        self.lock = threading.Lock()
+        self.running = workers
+        self.threads = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.in_queue.get()
+            if item is STOP:
+                # Let the other workers of the stage see the marker too
+                self.in_queue.put(STOP)
+                break
+
+            try:
+                outputs = self.func(item)
+            except Exception as e:
+                outputs = []
+                with self.lock:
+                    self.failed += 1
+                print(f"[{self.name}] failed on {item}: {e}")
+
+            with self.lock:
+                self.processed += 1
+                if outputs and self.first_output_time is None:
+                    self.first_output_time = time.perf_counter()
+
+            if self.out_queue is not None:
+                for output in outputs:
+                    self.out_queue.put(output)
+
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last and self.out_queue is not None:
+            self.out_queue.put(STOP)
+
+def run_streaming_pipeline(generator, headers, paths, latex_dir="data/latex", generated_dir="data/generated",
+                           queue_size=64, generation_workers=8, compile_workers=1, augment_workers=1, dpi=500,
+                           irregularity_engine="tikz", seed=None, fmt_dir=None, textcolors=None, pagecolors=None,
+                           raster_grid=False, cleanup=True, in_memory=False, write_clean=True, compile_timeout=None,
+                           lint=False, font_coverage=None, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Runs generation, header expansion, compilation, rasterization and augmentation as
+    concurrent stages connected by bounded queues, so every exercise flows through the
+    whole pipeline as soon as it is generated.
+
+    Args:
+        generator (LatexGenerator): Generator of the exercises.
+        headers (list of str): Headers from create_headers.
+        paths (list of str): Variant names from create_headers.
+        latex_dir (str): Directory of the generated LaTeX files.
+        generated_dir (str): Directory of the generated images.
+        queue_size (int): Maximum number of items waiting between two stages.
+        generation_workers (int): Number of LLM requests in flight.
+        compile_workers (int): Number of xelatex processes.
+        augment_workers (int): Number of threads rasterizing and augmenting images.
+        dpi (int): Resolution of the PNGs.
+        irregularity_engine (str): See add_irregularities.
+        seed: Seed of the irregularities drawn in Python and of the noise.
+        fmt_dir (str): If given, compile against one precompiled format per preamble.
+        textcolors (list of str): If given, the headers are black on white and the other
+            colors are derived from the PNGs (see derive_color_variants).
+        pagecolors (list of str): Page colors derived along with textcolors.
+        raster_grid (bool): Draw the grid variants on the PNGs (see add_grid_variants).
+        cleanup (bool): Delete the header TeX files and PDFs once they are used.
+        in_memory (bool): Rasterize and augment in a single stage, handing the rendered
+            pages to the augmentation in memory (see rasterize_and_augment).
+        write_clean (bool): With in_memory, also write the PNGs without noise and blur.
+        compile_timeout (float): Maximum duration of a compilation in seconds.
+        lint (bool): Repair or drop the generated documents that would fail to compile
+            (see latex_lint.lint_file).
+        font_coverage (dict): Characters of every font, the fonts lacking some characters
+            of an exercise are skipped for it (see add_headers_to_tex).
+        requests_per_minute (int): Optional limit on the number of LLM requests per minute.
+        tokens_per_minute (int): Optional limit on the prompt and generated tokens per minute.
+
+    Returns:
+        dict: Number of processed items and failures per stage.
+    """
+    print("Running the streaming pipeline...")
+    start_time = time.perf_counter()
+
+    formats = {}
+    formats_lock = threading.Lock()
+
+    def get_format(tex_path):
+        key = get_preamble_key(tex_path)
+        if key is None:
+            return None
+        # The first file with a new preamble dumps the format, the others wait for it
+        with formats_lock:
+            if key not in formats:
+                formats[key] = dump_format(tex_path, fmt_dir, "preamble_" + key, compile_timeout)
+            return formats[key]
+
+    # The generation workers share the rate limiters and the retries of the concurrent path
+    session = GenerationSession(generator, latex_dir, generation_workers, requests_per_minute, tokens_per_minute)
+
+    def generate(exercise_numbers):
+        content_paths = session.generate(exercise_numbers)
+        content_paths = [content_path for content_path in content_paths if content_path is not None]
+        if lint:
+            content_paths = [content_path for content_path in content_paths if lint_file(content_path) != "rejected"]
+        return content_paths
+
+    def expand_headers(content_path):
+        return add_headers_to_tex(content_path, headers, paths, irregularity_engine, seed, font_coverage)
+
+    def compile_tex(tex_path):
+        folder = os.path.basename(os.path.dirname(tex_path))
+        fmt_path = get_format(tex_path) if fmt_dir is not None else None
+        _, pdf_path = compile_tex_job(tex_path, os.path.join(generated_dir, folder), fmt_path, compile_timeout)
+        if cleanup:
+            os.remove(tex_path)
+        if pdf_path is None:
+            # Counted as a failure of the stage, see COMPILE_STATS for the cause
+            raise RuntimeError("xelatex did not produce a usable PDF")
+        return [pdf_path]
+
+    def rasterize(pdf_path):
+        png_path = convert_pdf_to_png(pdf_path, dpi)
+        if cleanup:
+            os.remove(pdf_path)
+        if png_path is None:
+            return []
+        png_paths = [png_path]
+        if textcolors is not None:
+            png_paths = derive_color_variants_png(png_paths[0], textcolors, pagecolors)
+        if raster_grid:
+            png_paths += [add_grid_png(png_path, dpi) for png_path in png_paths if png_path.endswith("_nogrid.png")]
+        return png_paths
+
+    # The noise only depends on the seed and on the image, like in the batch path
+    def augment(png_path):
+        return augment_png(png_path, rng=make_rng(seed, rng_key(png_path, generated_dir)))
+
+    def rasterize_augment(pdf_path):
+        png_paths = rasterize_and_augment(pdf_path, dpi, textcolors, pagecolors, raster_grid, write_clean,
+                                          rng=make_rng(seed, rng_key(pdf_path, generated_dir)))
+        if cleanup:
+            os.remove(pdf_path)
+        return png_paths
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(5)]
+    stages = [
+        StreamingStage("generate", generate, queues[0], queues[1], generation_workers),
+        StreamingStage("headers", expand_headers, queues[1], queues[2], 1),
+        StreamingStage("compile", compile_tex, queues[2], queues[3], compile_workers),
+    ]
+    if in_memory:
+        stages.append(StreamingStage("raster_augment", rasterize_augment, queues[3], None, augment_workers))
+    else:
+        stages.append(StreamingStage("raster", rasterize, queues[3], queues[4], augment_workers))
+        stages.append(StreamingStage("augment", augment, queues[4], None, augment_workers))
+    for stage in stages:
+        stage.start()
+
+    for exercise_numbers in generator.exercise_batches():
+        queues[0].put(exercise_numbers)
+    queues[0].put(STOP)
+
+    for stage in stages:
+        stage.join()
+    session.close()
+
+    summary = {stage.name: {"processed": stage.processed, "failed": stage.failed} for stage in stages}
+    first_sample = stages[-1].first_output_time
+    if first_sample is not None:
+        print(f"First sample after {first_sample - start_time:.1f}s.")
+    print(f"Streaming pipeline finished in {time.perf_counter() - start_time:.1f}s: {summary}")
+    COMPILE_STATS.print_summary()
+    return summary
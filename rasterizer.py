@@ -0,0 +1,70 @@
+import os
+import tempfile
+import threading
+from PIL import Image
+import numpy as np
+from os_utils import run_command
+from tracing import TRACER
+
+# pypdfium2 renders the PDFs in this process, without it every PDF goes through pdftoppm
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# PDFium is not thread-safe, the renderings of the worker threads take turns
+_pdfium_lock = threading.Lock()
+
+@TRACER.traced("raster")
+def render_pdf_pages(pdf_path, dpi=500, first_page_only=False):
+    """
+    Render the pages of a PDF into RGB arrays.
+
+    The pages are rendered in this process by pypdfium2 when it is installed, and by
+    pdftoppm otherwise.
+
+    Args:
+        pdf_path (str): Path of the PDF.
+        dpi (int): Resolution of the rendering.
+        first_page_only (bool): Only render the first page.
+
+    Returns:
+        list of numpy.ndarray: uint8 arrays of shape (height, width, 3), in page order.
+    """
+    if pdfium is None:
+        return render_pdf_pages_pdftoppm(pdf_path, dpi, first_page_only)
+
+    pages = []
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page_count = 1 if first_page_only else len(pdf)
+            for index in range(page_count):
+                page = pdf[index]
+                # The bitmap buffer is allocated by Python, so the array stays valid
+                # once the page and the document are closed
+                pages.append(page.render(scale=dpi / 72, rev_byteorder=True).to_numpy())
+                page.close()
+        finally:
+            pdf.close()
+    return pages
+
+def render_pdf_pages_pdftoppm(pdf_path, dpi=500, first_page_only=False):
+    """
+    Same as render_pdf_pages, through pdftoppm and temporary PNG files.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, "page")
+        options = ["-singlefile"] if first_page_only else []
+        if not run_command(["pdftoppm", "-r", str(dpi), *options, "-png", pdf_path, root]):
+            raise RuntimeError(f"pdftoppm failed on {pdf_path}")
+
+        # pdftoppm names the pages page.png, page-1.png or page-001.png depending on the page count
+        png_files = [f for f in os.listdir(tmp_dir) if f.endswith(".png")]
+        png_files.sort(key=lambda f: int(f[:-len(".png")].rsplit("-", 1)[-1]) if "-" in f else 0)
+
+        pages = []
+        for png_file in png_files:
+            with Image.open(os.path.join(tmp_dir, png_file)) as img:
+                pages.append(np.asarray(img.convert("RGB")))
+        return pages
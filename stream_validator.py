@@ -0,0 +1,202 @@
+import re
+
+BEGIN_DOCUMENT = "\\begin{document}"
+END_DOCUMENT = "\\end{document}"
+STRIKE_COMMAND = "\\strikeMistake"
+
+# Preamble commands, the headers already hold the preamble so xelatex fails on them in the body
+FORBIDDEN_PATTERN = re.compile(r"\\(?:documentclass|usepackage|RequirePackage|input|include)(?![a-zA-Z])")
+
+# Characters kept from the previous chunks, so the patterns split across two chunks are found
+OVERLAP = 32
+
+class StreamValidator:
+    def __init__(self, max_chars=20000, max_prefix_chars=2000, require_strike=True):
+        """
+        Incremental check of a streamed LLM answer, see feed.
+
+        The text before \\begin{document} is dropped by ensure_raw_tex, so only the
+        document body is checked for preamble commands and \\strikeMistake.
+
+        :param max_chars: Length after which the answer is a runaway
+        :param max_prefix_chars: Length after which an answer without \\begin{document} is rejected
+        :param require_strike: Reject the documents without \\strikeMistake
+        """
+        self.max_chars = max_chars
+        self.max_prefix_chars = max_prefix_chars
+        self.require_strike = require_strike
+        self.chunks = []
+        self.length = 0
+        self.tail = ""
+        self.body_start = None
+        self.has_strike = False
+        self.done = False
+        self.reason = None
+
+    @property
+    def text(self):
+        """Text received so far."""
+        return "".join(self.chunks)
+
+    def reject(self, reason):
+        self.reason = reason
+        self.done = True
+        return False
+
+    def feed(self, chunk):
+        """
+        Check a new chunk of the answer.
+
+        :param chunk: Text of the chunk
+        :return: False once the rest of the answer is not needed, either because the answer
+            is rejected (see reason) or because \\end{document} was received
+        """
+        if self.done:
+            return False
+        window = self.tail + chunk
+        # Absolute position of the window in the answer
+        start = self.length - len(self.tail)
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        self.tail = window[-OVERLAP:]
+
+        if self.body_start is None:
+            position = window.find(BEGIN_DOCUMENT)
+            if position >= 0:
+                self.body_start = start + position + len(BEGIN_DOCUMENT)
+            elif self.length > self.max_prefix_chars:
+                return self.reject("no \\begin{document}")
+
+        if self.body_start is not None:
+            body = window[max(0, self.body_start - start):]
+            end = body.find(END_DOCUMENT)
+            if end >= 0:
+                body = body[:end]
+            for match in FORBIDDEN_PATTERN.finditer(body):
+                # A match at the end of the window may be the start of a longer command
+                if end >= 0 or match.end() < len(body):
+                    return self.reject(f"{match.group()} in the document body")
+            self.has_strike = self.has_strike or STRIKE_COMMAND in body
+            if end >= 0:
+                self.done = True
+                if self.require_strike and not self.has_strike:
+                    return self.reject("no \\strikeMistake")
+                return False
+
+        if self.length > self.max_chars:
+            return self.reject(f"longer than {self.max_chars} characters")
+        return True
+
+    def finish(self):
+        """
+        Check the answer once the stream ended without \\end{document}.
+
+        :return: True if the answer is accepted
+        """
+        if self.done:
+            return self.reason is None
+        self.done = True
+        if self.body_start is None:
+            return self.reject("no \\begin{document}")
+        # Commands held back at the end of the last window
+        match = FORBIDDEN_PATTERN.search(self.tail, max(0, self.body_start - (self.length - len(self.tail))))
+        if match:
+            return self.reject(f"{match.group()} in the document body")
+        if self.require_strike and not self.has_strike:
+            return self.reject("no \\strikeMistake")
+        return True
+
+def validate_answer(answer, **options):
+    """
+    Check a complete answer, e.g. a cached one, like a streamed answer.
+
+    :param answer: Text of the answer
+    :param options: Parameters of StreamValidator
+    :return: The reason of the rejection, or None if the answer is accepted
+    """
+    validator = StreamValidator(**options)
+    validator.feed(answer)
+    validator.finish()
+    return validator.reason
+
+# Line written by the model before every document of a batched answer
+EXERCISE_SEPARATOR = "%%%% EXERCISE {} %%%%"
+SEPARATOR_PATTERN = re.compile(r"\s*%+\s*EXERCISE\s+(\d+)\s*%+\s*")
+
+class BatchStreamValidator:
+    def __init__(self, exercise_numbers, max_chars=20000, **options):
+        """
+        Incremental check of a streamed answer holding one document per exercise, each
+        preceded by its EXERCISE_SEPARATOR line. Every document is checked by its own
+        StreamValidator, so a rejected document does not reject the others.
+
+        :param exercise_numbers: Exercises requested in the batch
+        :param max_chars: Length after which a document is a runaway
+        :param options: Other parameters of StreamValidator
+        """
+        self.parts = {number: StreamValidator(max_chars=max_chars, **options) for number in exercise_numbers}
+        self.max_chars = max_chars * len(exercise_numbers)
+        self.chunks = []
+        self.length = 0
+        self.line = ""
+        self.current = None
+        self.done = False
+        self.reason = None
+
+    @property
+    def text(self):
+        """Text received so far."""
+        return "".join(self.chunks)
+
+    def _feed_line(self, line):
+        match = SEPARATOR_PATTERN.fullmatch(line)
+        if match:
+            # Unknown exercises are ignored until the next separator
+            self.current = self.parts.get(int(match.group(1)))
+        elif self.current is not None:
+            self.current.feed(line)
+
+    def feed(self, chunk):
+        """
+        Check a new chunk of the answer.
+
+        :param chunk: Text of the chunk
+        :return: False once every document is complete or rejected, or the answer is a runaway
+        """
+        if self.done:
+            return False
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        # The separators are matched on complete lines
+        lines = (self.line + chunk).split("\n")
+        self.line = lines.pop()
+        for line in lines:
+            self._feed_line(line + "\n")
+
+        if self.length > self.max_chars:
+            self.reason = f"longer than {self.max_chars} characters"
+            self.done = True
+        elif all(part.done for part in self.parts.values()):
+            self.done = True
+        return not self.done
+
+    def finish(self):
+        """
+        Check the documents once the stream ended.
+
+        :return: True if at least one document is accepted
+        """
+        if self.line:
+            self._feed_line(self.line)
+            self.line = ""
+        self.done = True
+        for part in self.parts.values():
+            part.finish()
+        return len(self.accepted_parts()) > 0
+
+    def accepted_parts(self):
+        """
+        Returns:
+            dict: The text of every accepted document, by exercise number.
+        """
+        return {number: part.text for number, part in self.parts.items() if part.reason is None}
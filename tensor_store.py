@@ -0,0 +1,91 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import numpy as np
+from os_utils import get_subfolders
+from utils import parse_variant_name
+from tracing import TRACER
+
+def index_path(store_path):
+    """Path of the sidecar index of a tensor store."""
+    return os.path.splitext(store_path)[0] + ".json"
+
+def load_image(png_path, height, width, channels=3):
+    """
+    Decode a PNG and resize it to a fixed shape.
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (height, width, channels).
+    """
+    with Image.open(png_path) as img:
+        img = img.convert("RGB" if channels == 3 else "L")
+        img = img.resize((width, height), Image.Resampling.BILINEAR, reducing_gap=3.0)
+        return np.asarray(img).reshape(height, width, channels)
+
+def _export_chunk(job):
+    store_path, start, png_paths = job
+    # Every worker opens the array itself and writes its own rows
+    store = np.load(store_path, mmap_mode="r+")
+    height, width, channels = store.shape[1:]
+    for offset, png_path in enumerate(png_paths):
+        store[start + offset] = load_image(png_path, height, width, channels)
+    store.flush()
+    return len(png_paths)
+
+@TRACER.traced()
+def export_tensor_store(generated_dir="data/generated", store_path="data/tensors.npy", shape=(512, 512), channels=3,
+                        workers=None, chunk_size=64):
+    """
+    Resize every PNG to a fixed shape and stack them in a memory-mapped .npy file, with a
+    sidecar JSON index listing the attributes of each sample (exercise, font, colors,
+    grid and augmentation, see parse_variant_name).
+
+    Args:
+        generated_dir (str): Directory of the generated images, one subfolder per exercise.
+        store_path (str): Path of the .npy file, the index is written next to it.
+        shape (tuple): (height, width) of the stored samples.
+        channels (int): 3 for RGB samples, 1 for grayscale.
+        workers (int): Number of processes decoding and resizing the PNGs.
+        chunk_size (int): Number of PNGs per job.
+
+    Returns:
+        int: Number of stored samples.
+    """
+    print("Exporting the tensor store...")
+    height, width = shape
+    png_paths = []
+    samples = []
+    for folder in sorted(get_subfolders(generated_dir), key=lambda f: (len(f), f)):
+        folder_path = os.path.join(generated_dir, folder)
+        for png_file in sorted(f for f in os.listdir(folder_path) if f.endswith(".png")):
+            png_paths.append(os.path.join(folder_path, png_file))
+            samples.append({"exercise": folder, "file": png_file, **(parse_variant_name(png_file) or {})})
+
+    directory = os.path.dirname(store_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    store = np.lib.format.open_memmap(store_path, mode="w+", dtype=np.uint8, shape=(len(png_paths), height, width, channels))
+    del store
+
+    jobs = [(store_path, start, png_paths[start:start + chunk_size]) for start in range(0, len(png_paths), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        stored = sum(executor.map(_export_chunk, jobs))
+
+    with open(index_path(store_path), "w", encoding="utf-8") as f:
+        json.dump({"shape": [len(png_paths), height, width, channels], "samples": samples}, f)
+
+    print(f"Stored {stored} samples of shape {height}x{width}x{channels} in {store_path}.")
+    return stored
+
+def load_tensor_store(store_path="data/tensors.npy"):
+    """
+    Memory-map a tensor store written by export_tensor_store.
+
+    Returns:
+        tuple: (read-only uint8 array of shape (samples, height, width, channels),
+        list of the attributes of every sample)
+    """
+    with open(index_path(store_path), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return np.load(store_path, mmap_mode="r"), index["samples"]
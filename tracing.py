@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+class Tracer:
+    def __init__(self):
+        """
+        Collects timed spans of the pipeline stages, external commands and LLM requests.
+
+        Tracing is disabled until enable is called, the spans then cost a few clock reads.
+        Every span records its wall time, the CPU time of the calling thread, whether it
+        succeeded, and the bytes written and retries reported by the traced code.
+        """
+        self.enabled = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def add(self, name, category, start, end, cpu_seconds=0.0, success=True, pid=None, tid=None, **args):
+        """
+        Record a span measured elsewhere, e.g. in a worker process.
+
+        :param start: perf_counter at the start of the span
+        :param end: perf_counter at the end of the span
+        """
+        if not self.enabled:
+            return
+        span = {
+            "name": name,
+            "category": category,
+            "start": start,
+            "end": end,
+            "cpu_seconds": cpu_seconds,
+            "success": success,
+            "pid": pid if pid is not None else os.getpid(),
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": args,
+        }
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        """
+        Time the code of a with block. The yielded dictionary collects the measures of
+        the traced code ("bytes_written", "retries"...) and "success" if the block
+        reports a failure without raising.
+        """
+        record = dict(args)
+        if not self.enabled:
+            yield record
+            return
+
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        success = True
+        try:
+            yield record
+        except BaseException:
+            success = False
+            raise
+        finally:
+            end = time.perf_counter()
+            success = record.pop("success", success)
+            # Commands report the CPU time of their child process instead
+            cpu_seconds = record.pop("cpu_seconds", time.thread_time() - cpu_start)
+            self.add(name, category, start, end, cpu_seconds, success, **record)
+
+    def traced(self, category="stage", name=None, outputs=None):
+        """
+        Decorator tracing every call of a function.
+
+        :param category: Category of the spans
+        :param name: Name of the spans, the name of the function by default
+        :param outputs: Function listing the files written by a call from its result,
+            the call failed if it is empty
+        """
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category) as span:
+                    result = func(*args, **kwargs)
+                    if outputs is not None and self.enabled:
+                        paths = outputs(result)
+                        span["bytes_written"] = sum(file_size(path) for path in paths)
+                        span["success"] = len(paths) > 0
+                    return result
+            return wrapper
+        return decorator
+
+    def export_chrome_trace(self, path):
+        """
+        Write the spans in the Chrome trace event format (chrome://tracing or Perfetto).
+        """
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        # Named rows (e.g. one per LLM request) get a number and a thread_name event
+        named_tids = {}
+        for span in spans:
+            tid = span["tid"]
+            if isinstance(tid, str):
+                if tid not in named_tids:
+                    named_tids[tid] = len(named_tids) + 1
+                    events.append({"name": "thread_name", "ph": "M", "pid": span["pid"], "tid": named_tids[tid], "args": {"name": tid}})
+                tid = named_tids[tid]
+            events.append({
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": (span["start"] - self.origin) * 1e6,
+                "dur": (span["end"] - span["start"]) * 1e6,
+                "pid": span["pid"],
+                "tid": tid,
+                "args": {"cpu_seconds": span["cpu_seconds"], "success": span["success"], **span["args"]},
+            })
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def summary(self):
+        """
+        Aggregate the spans by category and name.
+
+        Returns:
+            dict: For every "category/name", the number of calls and failures, the total
+            wall and CPU time, the bytes written and the retries.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        metrics = {}
+        for span in spans:
+            metric = metrics.setdefault(f"{span['category']}/{span['name']}", {
+                "calls": 0, "failures": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "bytes_written": 0, "retries": 0,
+            })
+            metric["calls"] += 1
+            metric["failures"] += 0 if span["success"] else 1
+            metric["wall_seconds"] += span["end"] - span["start"]
+            metric["cpu_seconds"] += span["cpu_seconds"]
+            metric["bytes_written"] += span["args"].get("bytes_written", 0)
+            metric["retries"] += span["args"].get("retries", 0)
+        return metrics
+
+    def write_summary(self, path):
+        """Write the summary as JSON and print the slowest entries."""
+        metrics = self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=1)
+
+        print("Time spent per stage:")
+        for key, metric in sorted(metrics.items(), key=lambda item: -item[1]["wall_seconds"])[:15]:
+            print(f"  {key}: {metric['calls']} calls, {metric['failures']} failed, "
+                  f"{metric['wall_seconds']:.1f}s wall, {metric['cpu_seconds']:.1f}s CPU")
+
+# Tracer shared by all the modules, enabled by main.py --trace
+TRACER = Tracer()
+
+def file_size(path):
+    """Size of a file, 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
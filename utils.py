@@ -1,12 +1,38 @@
 import os
+import hashlib
+import json
+import shutil
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from os_utils import *
-from PIL import Image, ImageFilter
+from build_manifest import hash_file, hash_values
+from augmentation import AUGMENTATION_SUFFIXES, is_augmented, augmented_paths, augment_png, augment_pngs, augment_pixels, make_rng, rng_key
+from rasterizer import pdfium, render_pdf_pages
+from tracing import TRACER
+from compile_watchdog import COMPILE_STATS, classify_compile
+from glyph_coverage import fonts_to_skip
+from PIL import Image
 import numpy as np
 import random
 import re
 
-def compile_tex_to_pdf(tex_path, output_path=None):
-    """Compile a TeX file into a PDF and store it in the specified output path."""
+# Separates the package loading part of a generated header from the rest of it.
+# It expands to \relax in a normal run and marks the end of the dumped preamble
+# for mylatexformat.
+FORMAT_MARKER = r"\csname endofdump\endcsname"
+
+def compile_tex_to_pdf(tex_path, output_path=None, fmt_path=None, timeout=None):
+    """
+    Compile a TeX file into a PDF and store it in the specified output path.
+
+    If fmt_path is given, the file is compiled against that precompiled format. When
+    the format cannot be loaded at all (e.g. it was dumped by another TeX version),
+    no log is written and the file is compiled again without it.
+
+    xelatex is killed after timeout seconds. The outcome of the compilation is read
+    from the log and recorded in COMPILE_STATS.
+    """
     if output_path is None:
         base_dir = "generated_data"
         output_path = os.path.join(base_dir, "pdf")
@@ -16,16 +42,101 @@ def compile_tex_to_pdf(tex_path, output_path=None):
     tex_filename = os.path.basename(tex_path)
     pdf_filename = os.path.splitext(tex_filename)[0] + ".pdf"
     pdf_path_final = os.path.join(output_path, pdf_filename)
+    log_path = os.path.join(output_path, os.path.splitext(tex_filename)[0] + ".log")
+    start = time.perf_counter()
+
+    status = None
+    if fmt_path is not None:
+        fmt_dir, fmt_filename = os.path.split(fmt_path)
+        # The trailing separator keeps the default search path for the standard formats
+        env = {"TEXFORMATS": os.path.abspath(fmt_dir) + os.pathsep}
+        fmt_name = os.path.splitext(fmt_filename)[0]
+        status = run_process(["xelatex", f"-fmt={fmt_name}", "-interaction=nonstopmode", f"-output-directory={output_path}", tex_path], env=env, timeout=timeout)
 
-    run_command(f"xelatex -interaction=nonstopmode -output-directory={output_path} {tex_path}")
+    if status is None or (status != "timeout" and not check_file_exists(log_path)):
+        status = run_process(["xelatex", "-interaction=nonstopmode", f"-output-directory={output_path}", tex_path], timeout=timeout)
 
-    if not check_file_exists(os.path.join(output_path, pdf_filename)):
+    pdf_ok = status != "timeout" and check_file_exists(pdf_path_final)
+    outcome = classify_compile(log_path, status, pdf_ok)
+    COMPILE_STATS.record(tex_path, outcome, time.perf_counter() - start)
+
+    # In nonstopmode the PDF written after a recoverable error is kept, the error is
+    # only recorded in COMPILE_STATS
+    if not pdf_ok:
         return None
 
     return pdf_path_final
 
+def get_preamble_key(tex_path):
+    """
+    Get a key identifying the dumpable preamble of a TeX file.
+
+    Returns:
+        str: Hash of everything before FORMAT_MARKER, or None if the file has no marker.
+    """
+    with open(tex_path, "r", encoding="utf-8") as tex_file:
+        tex_content = tex_file.read()
+
+    if FORMAT_MARKER not in tex_content:
+        return None
+
+    preamble = tex_content.split(FORMAT_MARKER, 1)[0]
+    return hashlib.sha1(preamble.encode("utf-8")).hexdigest()[:16]
+
+def dump_format(tex_path, fmt_dir, fmt_name, timeout=None):
+    """
+    Dump the preamble of a TeX file (up to FORMAT_MARKER) into a custom xelatex format.
+
+    Returns:
+        str: Path of the .fmt file, or None if the dump failed.
+    """
+    create_folder(fmt_dir)
+    fmt_path = os.path.join(fmt_dir, fmt_name + ".fmt")
+    if check_file_exists(fmt_path):
+        return fmt_path
+
+    run_command(["xelatex", "-ini", "-interaction=nonstopmode", f"-jobname={fmt_name}", f"-output-directory={fmt_dir}",
+                 "&xelatex", "mylatexformat.ltx", tex_path], timeout=timeout)
+    delete_aux_files(fmt_dir)
+
+    if not check_file_exists(fmt_path):
+        return None
+
+    return fmt_path
+
+@TRACER.traced()
+def dump_formats(tex_paths, fmt_dir="data/formats", timeout=None):
+    """
+    Dump one format per distinct preamble found in the given TeX files.
+
+    Formats are reused across runs since their name is derived from the preamble.
+
+    Returns:
+        dict: Mapping from TeX path to its format path (None if no format is available).
+    """
+    print("Dumping format files...")
+    formats = {}
+    fmt_paths = {}
+    for tex_path in tex_paths:
+        key = get_preamble_key(tex_path)
+        if key is None:
+            fmt_paths[tex_path] = None
+            continue
+        if key not in formats:
+            formats[key] = dump_format(tex_path, fmt_dir, "preamble_" + key, timeout)
+        fmt_paths[tex_path] = formats[key]
+
+    print(f"Using {len([f for f in formats.values() if f is not None])} format files.")
+    return fmt_paths
+
+@TRACER.traced("raster", outputs=lambda png_path: [png_path] if png_path else [])
 def convert_pdf_to_png(pdf_path, dpi=500):
-    """Convert a PDF to PNG format while preserving the original directory structure."""
+    """
+    Convert a PDF to PNG format while preserving the original directory structure.
+
+    Returns:
+        str: Path of the PNG, or None if the PDF could not be rendered.
+    """
     base_dir = os.path.dirname(pdf_path)
     create_folder(base_dir) 
 
@@ -33,8 +144,22 @@ def convert_pdf_to_png(pdf_path, dpi=500):
     png_filename = os.path.splitext(pdf_filename)[0] + ".png" 
     output_path = os.path.join(base_dir, png_filename)
 
+    if pdfium is not None:
+        # Render the first page in this process
+        try:
+            page = render_pdf_pages(pdf_path, dpi, first_page_only=True)[0]
+            Image.fromarray(page, "RGB").save(output_path)
+            return output_path
+        except Exception as e:
+            if shutil.which("pdftoppm") is None:
+                print(f"Failed to render {pdf_path}: {e}")
+                return None
+            print(f"Failed to render {pdf_path} with pypdfium2 ({e}), retrying with pdftoppm...")
+
     # Convert the PDF to PNG using pdftoppm
-    run_command(f"pdftoppm -r {dpi} {pdf_path} -png -singlefile {output_path[:-4]}")
+    if not run_command(["pdftoppm", "-r", str(dpi), pdf_path, "-png", "-singlefile", output_path[:-4]]):
+        print(f"Failed to render {pdf_path}")
+        return None
 
     return output_path
 
@@ -49,21 +174,104 @@ def delete_aux_files(tex_dir):
             file_to_delete = os.path.join(tex_dir, file)
             os.remove(file_to_delete)
 
-def convert_tex_to_pdf(input_dir="data/latex", ouptur_dir="data/generated"):
-    """Convert all TeX files in the specified directory to PDF format."""
+@TRACER.traced("compile", outputs=lambda result: [result[1]] if result[1] else [])
+def compile_tex_job(tex_path, output_path, fmt_path=None, timeout=None):
+    """
+    Compile a TeX file in its own auxiliary directory and move the PDF to output_path.
+
+    Each job writes into a private directory so that concurrent jobs never see or
+    delete each other's auxiliary files.
+
+    Returns:
+        tuple: (tex_path, pdf_path) where pdf_path is None if the compilation failed.
+    """
+    job_name = os.path.splitext(os.path.basename(tex_path))[0]
+    aux_dir = os.path.join(output_path, ".aux_" + job_name)
+    create_folder(output_path)
+
+    pdf_path = compile_tex_to_pdf(tex_path, aux_dir, fmt_path, timeout)
+    if pdf_path is not None:
+        pdf_path_final = os.path.join(output_path, os.path.basename(pdf_path))
+        os.replace(pdf_path, pdf_path_final)
+        pdf_path = pdf_path_final
+
+    shutil.rmtree(aux_dir, ignore_errors=True)
+    return tex_path, pdf_path
+
+@TRACER.traced()
+def convert_tex_to_pdf(input_dir="data/latex", ouptur_dir="data/generated", workers=1, fmt_dir=None, manifest=None, timeout=None):
+    """
+    Convert all TeX files in the specified directory to PDF format.
+
+    Args:
+        input_dir (str): Directory containing one subfolder of TeX files per exercise.
+        ouptur_dir (str): Directory where the PDFs are written, mirroring input_dir.
+        workers (int): Number of xelatex processes to run concurrently.
+        fmt_dir (str): If given, precompile one format per distinct preamble into this
+            directory and compile every file against it.
+        manifest (BuildManifest): If given, skip the files compiled before from the same source.
+        timeout (float): Maximum duration of a compilation in seconds.
+
+    Returns:
+        list of tuple: (tex_path, pdf_path) for every job, pdf_path is None on failure.
+    """
     print("Converting TeX files to PDF...")
+    jobs = []
     folders = get_subfolders(input_dir)
     for folder in folders:
         tex_path = os.path.join(input_dir, folder)
         tex_files = [f for f in os.listdir(tex_path) if f.endswith(".tex") and f != "content.tex"]
         output_path = os.path.join(ouptur_dir, folder)
         for tex_file in tex_files:
-            input_path = os.path.join(tex_path, tex_file)
-            compile_tex_to_pdf(input_path, output_path) 
-            delete_aux_files(output_path)
+            jobs.append((os.path.join(tex_path, tex_file), output_path))
+
+    up_to_date = []
+    if manifest is not None:
+        inputs = {}
+        pending = []
+        for input_path, output_path in jobs:
+            pdf_path = os.path.join(output_path, os.path.splitext(os.path.basename(input_path))[0] + ".pdf")
+            inputs[input_path] = hash_file(input_path)
+            if manifest.is_fresh("compile", pdf_path, inputs[input_path]):
+                up_to_date.append((input_path, pdf_path))
+            else:
+                pending.append((input_path, output_path))
+        jobs = pending
+        print(f"Skipping {len(up_to_date)} up-to-date PDF files.")
+
+    fmt_paths = {}
+    if fmt_dir is not None:
+        fmt_paths = dump_formats([input_path for input_path, _ in jobs], fmt_dir, timeout)
+    jobs = [(input_path, output_path, fmt_paths.get(input_path), timeout) for input_path, output_path in jobs]
+
+    if workers <= 1:
+        results = [compile_tex_job(*job) for job in jobs]
+    else:
+        # xelatex is an external process, so threads are enough to keep every core busy
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda job: compile_tex_job(*job), jobs))
+
+    if manifest is not None:
+        for tex_path, pdf_path in results:
+            if pdf_path is not None:
+                manifest.record("compile", pdf_path, inputs[tex_path], [pdf_path])
+    results = up_to_date + results
+
+    failed = [tex_path for tex_path, pdf_path in results if pdf_path is None]
+    print(f"Compiled {len(results) - len(failed)}/{len(results)} TeX files.")
+    for tex_path in failed:
+        print(f"Failed to compile {tex_path}")
+    COMPILE_STATS.print_summary()
 
-def convert_pdf_to_pngs(input_dir="generated_data/pdf"):
-    """Convert all PDF files in the specified directory to PNG format."""
+    return results
+
+@TRACER.traced()
+def convert_pdf_to_pngs(input_dir="generated_data/pdf", dpi=500, manifest=None):
+    """
+    Convert all PDF files in the specified directory to PNG format.
+
+    If a BuildManifest is given, the PDFs converted before at the same DPI are skipped.
+    """
     print("Converting PDF files to PNG...")
     folders = get_subfolders(input_dir)
     for folder in folders:
@@ -71,22 +279,233 @@ def convert_pdf_to_pngs(input_dir="generated_data/pdf"):
         pdf_files = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.endswith(".pdf")]
 
         for pdf_file in pdf_files:
-            convert_pdf_to_png(pdf_file)
+            if manifest is None:
+                convert_pdf_to_png(pdf_file, dpi)
+                continue
+
+            png_path = os.path.splitext(pdf_file)[0] + ".png"
+            inputs = hash_values(hash_file(pdf_file), dpi)
+            if manifest.is_fresh("raster", png_path, inputs):
+                continue
+            png_path = convert_pdf_to_png(pdf_file, dpi)
+            if png_path is not None and check_file_exists(png_path):
+                manifest.record("raster", png_path, inputs, [png_path])
+
+@TRACER.traced()
+def create_batches(tex_dir="data/latex", batch_dir="data/batches", batch_size=100):
+    """
+    Concatenate the exercises sharing a header variant into multi-page TeX documents.
+
+    Every exercise becomes one page of a standalone document in multi mode. A JSON file
+    next to each batch lists the exercise folders in page order.
+
+    Args:
+        tex_dir (str): Directory containing the per-exercise files from add_headers.
+        batch_dir (str): Directory where the batch TeX files are written.
+        batch_size (int): Maximum number of exercises per batch.
+
+    Returns:
+        list of str: Paths of the batch TeX files.
+    """
+    print("Creating batches of TeX files...")
+    create_folder(batch_dir)
+
+    # variant -> (header, [(folder, source_path, body)])
+    variants = {}
+    for folder in sorted(get_subfolders(tex_dir)):
+        tex_directory = os.path.join(tex_dir, folder)
+        tex_files = sorted(f for f in os.listdir(tex_directory) if f.endswith(".tex") and f != "content.tex")
+        for tex_file in tex_files:
+            variant = tex_file[len("content_"):-len(".tex")]
+            tex_path = os.path.join(tex_directory, tex_file)
+            with open(tex_path, "r", encoding="utf-8") as f:
+                tex_content = f.read()
+
+            header, _, body = tex_content.partition("\\begin{document}")
+            body = body.rsplit("\\end{document}", 1)[0]
+            variants.setdefault(variant, (header, []))[1].append((folder, tex_path, body))
+
+    batch_paths = []
+    for variant, (header, members) in variants.items():
+        # standalone crops every "standalone" environment to its own page in multi mode
+        batch_header = header.replace("]{standalone}", ", multi]{standalone}", 1)
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            batch_name = f"content_{variant}_batch{start // batch_size}"
+            pages = "\n".join(f"\\begin{{standalone}}{body}\\end{{standalone}}" for _, _, body in batch)
+
+            batch_path = os.path.join(batch_dir, batch_name + ".tex")
+            with open(batch_path, "w", encoding="utf-8") as f:
+                f.write(batch_header + "\\begin{document}\n" + pages + "\n\\end{document}")
+
+            with open(os.path.join(batch_dir, batch_name + ".json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "variant": variant,
+                    "folders": [folder for folder, _, _ in batch],
+                    "sources": [tex_path for _, tex_path, _ in batch],
+                }, f, indent=2)
+            batch_paths.append(batch_path)
+
+    print(f"Created {len(batch_paths)} batches.")
+    return batch_paths
+
+def split_pdf_to_pngs(pdf_path, dpi=500):
+    """
+    Convert every page of a PDF to its own PNG.
+
+    Returns:
+        list of str: PNG paths in page order.
+    """
+    pages_dir = os.path.splitext(pdf_path)[0] + "_pages"
+    shutil.rmtree(pages_dir, ignore_errors=True)
+    create_folder(pages_dir)
+
+    if pdfium is not None:
+        try:
+            pages = render_pdf_pages(pdf_path, dpi)
+            png_paths = [os.path.join(pages_dir, f"page-{i}.png") for i in range(1, len(pages) + 1)]
+            for page, png_path in zip(pages, png_paths):
+                Image.fromarray(page, "RGB").save(png_path)
+            return png_paths
+        except Exception as e:
+            if shutil.which("pdftoppm") is None:
+                print(f"Failed to render {pdf_path}: {e}")
+                return []
+            print(f"Failed to render {pdf_path} with pypdfium2 ({e}), retrying with pdftoppm...")
+            # Pages written before the error would be listed with the pdftoppm ones
+            shutil.rmtree(pages_dir, ignore_errors=True)
+            create_folder(pages_dir)
+
+    run_command(["pdftoppm", "-r", str(dpi), pdf_path, "-png", os.path.join(pages_dir, "page")])
+
+    # pdftoppm names the pages page-1.png or page-001.png depending on the page count
+    png_files = [f for f in os.listdir(pages_dir) if f.endswith(".png")]
+    png_files.sort(key=lambda f: int(f[:-len(".png")].rsplit("-", 1)[1]))
+    return [os.path.join(pages_dir, f) for f in png_files]
 
-def add_headers_to_tex(tex_path, headers, paths):
+@TRACER.traced("raster", outputs=lambda results: [png_path for _, png_path in results if png_path])
+def convert_batch_to_pngs(batch_path, output_dir="data/generated", dpi=500, fmt_path=None, timeout=None, exercise_format=None):
+    """
+    Compile a batch TeX file and write each page to output_dir/<folder>/content_<variant>.png.
+
+    If the batch does not compile or does not have one page per exercise, every
+    exercise of the batch is compiled and converted on its own instead, against the
+    format returned by exercise_format for its TeX file if given. The timeout of a
+    single exercise is scaled by the number of exercises for the batch.
+
+    Returns:
+        list of tuple: (folder, png_path) for every exercise, png_path is None on failure.
+    """
+    with open(os.path.splitext(batch_path)[0] + ".json", "r", encoding="utf-8") as f:
+        batch = json.load(f)
+    png_filename = f"content_{batch['variant']}.png"
+
+    batch_timeout = timeout * len(batch["folders"]) if timeout is not None else None
+    _, pdf_path = compile_tex_job(batch_path, os.path.dirname(batch_path), fmt_path, batch_timeout)
+    png_paths = split_pdf_to_pngs(pdf_path, dpi) if pdf_path is not None else []
+
+    results = []
+    if len(png_paths) == len(batch["folders"]):
+        for folder, png_path in zip(batch["folders"], png_paths):
+            output_path = os.path.join(output_dir, folder)
+            create_folder(output_path)
+            png_path_final = os.path.join(output_path, png_filename)
+            os.replace(png_path, png_path_final)
+            results.append((folder, png_path_final))
+    else:
+        print(f"Batch {batch_path} failed, compiling its exercises one by one...")
+        for folder, tex_path in zip(batch["folders"], batch["sources"]):
+            exercise_fmt = exercise_format(tex_path) if exercise_format is not None else None
+            _, exercise_pdf = compile_tex_job(tex_path, os.path.join(output_dir, folder), exercise_fmt, timeout)
+            png_path = convert_pdf_to_png(exercise_pdf, dpi) if exercise_pdf is not None else None
+            results.append((folder, png_path))
+
+    if pdf_path is not None:
+        shutil.rmtree(os.path.splitext(pdf_path)[0] + "_pages", ignore_errors=True)
+    return results
+
+@TRACER.traced()
+def convert_batches_to_pngs(batch_dir="data/batches", output_dir="data/generated", dpi=500, workers=1, fmt_dir=None, timeout=None):
+    """
+    Compile and rasterize all batch TeX files created by create_batches.
+
+    Args:
+        batch_dir (str): Directory containing the batch TeX files.
+        output_dir (str): Directory where the PNGs are written, one subfolder per exercise.
+        dpi (int): Resolution of the PNGs.
+        workers (int): Number of batches to process concurrently.
+        fmt_dir (str): If given, compile the batches against precompiled formats.
+        timeout (float): Maximum compilation time per exercise in seconds.
+
+    Returns:
+        list of tuple: (folder, png_path) for every exercise, png_path is None on failure.
+    """
+    print("Converting batches to PNG...")
+    batch_paths = sorted(os.path.join(batch_dir, f) for f in os.listdir(batch_dir) if f.endswith(".tex"))
+
+    fmt_paths = {}
+    if fmt_dir is not None:
+        fmt_paths = dump_formats(batch_paths, fmt_dir, timeout)
+
+    # The single exercises have another preamble than the batches (no multi option), their
+    # formats are only dumped when a batch falls back to them
+    exercise_formats = {}
+    exercise_formats_lock = threading.Lock()
+
+    def exercise_format(tex_path):
+        key = get_preamble_key(tex_path)
+        if key is None:
+            return None
+        with exercise_formats_lock:
+            if key not in exercise_formats:
+                exercise_formats[key] = dump_format(tex_path, fmt_dir, "preamble_" + key, timeout)
+            return exercise_formats[key]
+
+    def process(batch_path):
+        return convert_batch_to_pngs(batch_path, output_dir, dpi, fmt_paths.get(batch_path), timeout,
+                                     exercise_format if fmt_dir is not None else None)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = [result for batch_results in executor.map(process, batch_paths) for result in batch_results]
+
+    failed = [folder for folder, png_path in results if png_path is None]
+    print(f"Converted {len(results) - len(failed)}/{len(results)} pages.")
+    return results
+
+@TRACER.traced("headers", outputs=lambda tex_paths: tex_paths)
+def add_headers_to_tex(tex_path, headers, paths, irregularity_engine="tikz", seed=None, font_coverage=None):
     """
     Add multiple headers to a TeX file, creating a new file for each header.
+
+    See add_irregularities for irregularity_engine. The seed is combined with the file
+    path, so every file gets different but reproducible irregularities.
+
+    With font_coverage (see glyph_coverage.load_font_coverage), the headers of the fonts
+    lacking some characters of the file are skipped, since xelatex would typeset these
+    characters with the fallback font.
+
+    Returns:
+        list of str: Paths of the new files (empty if the content does not start with
+            \\begin{document}).
     """
     with open(tex_path, "r", encoding="utf-8") as tex_file:
         tex_content = tex_file.read()
 
-    tex_content = add_irregularities(tex_content)
+    skipped_fonts = fonts_to_skip(tex_content, font_coverage) if font_coverage else {}
+    for font, missing in skipped_fonts.items():
+        print(f"Skipping {font} for {tex_path}, missing characters: {''.join(missing)}")
+
+    file_seed = None if seed is None else f"{seed}:{tex_path}"
+    tex_content = add_irregularities(tex_content, irregularity_engine, file_seed)
     if not tex_content.lstrip().startswith(r"\begin{document}"):
-        return
+        return []
     # with open(tex_path, "w", encoding="utf-8") as tex_file:
     #     tex_file.write(tex_content)
-        
+
+    new_tex_paths = []
     for idx, header in enumerate(headers):
+        if skipped_fonts and (parse_variant_name(f"content_{paths[idx]}.png") or {}).get("font") in skipped_fonts:
+            continue
         new_tex_content = header + tex_content
         
         # Generate a new filename based on the index
@@ -94,7 +513,11 @@ def add_headers_to_tex(tex_path, headers, paths):
         
         with open(new_tex_path, "w", encoding="utf-8") as new_tex_file:
             new_tex_file.write(new_tex_content)
-    
+        new_tex_paths.append(new_tex_path)
+
+    return new_tex_paths
+
+@TRACER.traced()
 def clean_tex_headers(tex_dir="data/latex"):
     """ Delete all TeX files except 'content.tex' in the specified directory"""
     print("Cleaning TeX headers...")
@@ -106,6 +529,7 @@ def clean_tex_headers(tex_dir="data/latex"):
             tex_path = os.path.join(current_folder_path, tex_file)
             os.remove(tex_path)
 
+@TRACER.traced()
 def delete_pdfs(pdf_dir="data/generated"):
     """ Delete all PDF files in the specified directory. """
     print("Deleting PDF files...")
@@ -117,20 +541,22 @@ def delete_pdfs(pdf_dir="data/generated"):
             pdf_path = os.path.join(current_folder_path, pdf)
             os.remove(pdf_path)
 
-def add_headers(tex_dir="data/latex", headers=["\\documentclass{article}\n"], paths=["default"]):
+@TRACER.traced()
+def add_headers(tex_dir="data/latex", headers=["\\documentclass{article}\n"], paths=["default"], irregularity_engine="tikz", seed=None, font_coverage=None):
     """
-    Add headers to all TeX files.
+    Add headers to all TeX files, see add_headers_to_tex for font_coverage.
     """
     folders = get_subfolders(tex_dir)
     for folder in folders:
         tex_directory = os.path.join(tex_dir, folder)
-        tex_files = [f for f in os.listdir(tex_directory) if f.endswith(".tex")]
+        # Only the generated content, not the files written by a previous call
+        tex_files = [f for f in os.listdir(tex_directory) if f == "content.tex"]
 
         for tex_file in tex_files:
             tex_path = os.path.join(tex_directory, tex_file)
-            add_headers_to_tex(tex_path, headers, paths)
+            add_headers_to_tex(tex_path, headers, paths, irregularity_engine, seed, font_coverage)
             
-def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
+def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"], grid=True):
     """
     Generate a list of LaTeX headers based on fonts, page colors, and text colors.
 
@@ -138,17 +564,21 @@ def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
         fonts (list of str): List of font names.
         pagecolors (list of str): List of page background colors.
         textcolors (list of str): List of text colors.
+        grid (bool): Whether to also generate headers drawing a grid in the background.
+            Without them, grids can be added to the PNGs with add_grid_variants.
 
     Returns:
         list of str: A list of LaTeX headers as strings.
     """
-    grids = ["", r"""\usepackage{tikz}
-\usepackage{eso-pic}
-\AddToShipoutPictureBG{
+    # Each grid is split into the packages it needs (dumped into the format file)
+    # and the code drawing it (executed on every run)
+    grids = [("", ""), (r"\usepackage{eso-pic}", r"""\AddToShipoutPictureBG{
 \begin{tikzpicture}[remember picture, overlay]
     \draw[step=5mm, black!20, thin] (current bounding box.south west) grid (current bounding box.north east);
 \end{tikzpicture}
-}"""]
+}""")]
+    if not grid:
+        grids = grids[:1]
     irregularities = r"""
 \newcommand{\irregularword}[1]{%
   \pgfmathsetmacro{\yshift}{(random()-0.5)*3} % Random y-shift between -3pt and 3pt
@@ -158,7 +588,6 @@ def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
   }%
 }
 
-\usepackage{xparse}
 \ExplSyntaxOn
 \NewDocumentCommand{\processtext}{+m}{
   \seq_set_split:Nnn \l_tmpa_seq { ~ } { #1 }
@@ -167,7 +596,7 @@ def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
 \ExplSyntaxOff"""
     headers = []
     paths = []
-    for grid in grids:
+    for grid_packages, grid in grids:
         for font in fonts:
             font_code = get_font_template(font)
             for pagecolor in pagecolors:
@@ -185,14 +614,19 @@ def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
                     if pagecolor == "paper":
                         color_rgb2 = r"\definecolor{paper}{rgb}{0.878, 0.788, 0.65}"
 
+                    # Everything before FORMAT_MARKER only loads packages and can be
+                    # precompiled into a format file, see dump_format
                     header = r"""\documentclass[varwidth=true, border=10mm]{standalone}
 \usepackage{tikz}
 \usetikzlibrary{calc}
-%s
 \usepackage{fontspec}
 \usepackage{amsmath}
 \usepackage{mathspec}
 \usepackage{xcolor} 
+\usepackage{xparse}
+%s
+%s
+%s
 %s
 %s
 %s
@@ -202,47 +636,317 @@ def create_headers(fonts, pagecolors = ["white"], textcolors = ["black"]):
 %s
 \setlength{\parindent}{0pt}
 \raggedright
-""" % (strike_code, font_code, color_rgb1, color_rgb2, pagecolor, textcolor, grid, irregularities)
+""" % (grid_packages, FORMAT_MARKER, strike_code, font_code, color_rgb1, color_rgb2, pagecolor, textcolor, grid, irregularities)
                     headers.append(header)
     return (headers, paths)
 
-def add_noise_and_blur(directory="data/generated", noise_level=100, blur_radius=2):
-    """ Generates noisy and blurred versions of PNG images in the specified directory. """
+def parse_variant_name(png_file):
+    """
+    Parse the attributes of a generated PNG from its name, e.g.
+    content_redtext_paperpage_JaneAusten_grid_noisy.png.
+
+    Returns:
+        dict: textcolor, pagecolor, font, grid (bool) and augmentation (None, "noisy",
+        "blurred" or "noisy_blurred"), or None if the name does not match.
+    """
+    match = re.fullmatch(r"content_(\w+?)text_(\w+?)page_(\w+)_(grid|nogrid)(_noisy_blurred|_noisy|_blurred)?\.png",
+                         os.path.basename(png_file))
+    if match is None:
+        return None
+    textcolor, pagecolor, font, grid, augmentation = match.groups()
+    return {
+        "textcolor": textcolor,
+        "pagecolor": pagecolor,
+        "font": font,
+        "grid": grid == "grid",
+        "augmentation": augmentation[1:] if augmentation else None,
+    }
+
+# RGB values of the named colors used in the headers, see create_headers
+COLOR_RGB = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+    "red": (255, 0, 0),
+    "darkblue": (0, 0, 140),
+    "paper": (224, 201, 166),
+}
+
+def recolor_image(img, textcolor, pagecolor):
+    """
+    Recolor a black-on-white render as if it had been compiled with other colors.
+
+    Every gray level is treated as the ink coverage of the pixel, so anti-aliased
+    edges blend between the page and text colors like the rasterizer would.
+
+    Args:
+        img (Pillow.Image): Black-on-white image.
+        textcolor (str): Name of the new text color (key of COLOR_RGB).
+        pagecolor (str): Name of the new page color (key of COLOR_RGB).
+
+    Returns:
+        Pillow.Image: Recolored RGB image.
+    """
+    text_rgb = np.array(COLOR_RGB[textcolor], dtype=np.float32)
+    page_rgb = np.array(COLOR_RGB[pagecolor], dtype=np.float32)
+
+    # One output color per gray level: 255 is the page, 0 is the text
+    coverage = 1.0 - np.arange(256, dtype=np.float32) / 255.0
+    lut = np.rint(page_rgb + coverage[:, None] * (text_rgb - page_rgb)).astype(np.uint8)
+
+    gray = np.asarray(img.convert("L"))
+    return Image.fromarray(lut[gray], "RGB")
+
+@TRACER.traced()
+def derive_color_variants(directory="data/generated", textcolors=["black"], pagecolors=["white"], base_textcolor="black", base_pagecolor="white"):
+    """
+    Derive every text/page color variant from the black-on-white PNGs of each exercise.
+
+    Use it with headers created for base_textcolor and base_pagecolor only, so that each
+    font is compiled once instead of once per color combination. The base PNG is removed
+    if its colors are not part of the requested ones.
+    """
+    print("Deriving color variants...")
+    base_prefix = f"content_{base_textcolor}text_{base_pagecolor}page_"
+
+    folders = get_subfolders(directory)
+    for folder in folders:
+        folder = os.path.join(directory, folder)
+        png_files = [f for f in os.listdir(folder) if f.startswith(base_prefix) and f.endswith(".png") and not is_augmented(f)]
+
+        for png_file in png_files:
+            derive_color_variants_png(os.path.join(folder, png_file), textcolors, pagecolors, base_textcolor, base_pagecolor)
+
+@TRACER.traced("raster", outputs=lambda png_paths: png_paths)
+def derive_color_variants_png(file_path, textcolors=["black"], pagecolors=["white"], base_textcolor="black", base_pagecolor="white"):
+    """
+    Derive every text/page color variant of a single black-on-white PNG.
+
+    Returns:
+        list of str: Paths of the requested variants, including the base PNG if kept.
+    """
+    keep_base = base_textcolor in textcolors and base_pagecolor in pagecolors
+
+    variant_paths = [file_path] if keep_base else []
+    with Image.open(file_path) as img:
+        for variant_path, textcolor, pagecolor in color_variants(file_path, textcolors, pagecolors, base_textcolor, base_pagecolor):
+            recolor_image(img, textcolor, pagecolor).save(variant_path)
+            variant_paths.append(variant_path)
+
+    if not keep_base:
+        os.remove(file_path)
+    return variant_paths
+
+def color_variants(file_path, textcolors=["black"], pagecolors=["white"], base_textcolor="black", base_pagecolor="white"):
+    """
+    List the color variants derived from a black-on-white PNG, without the base colors.
+
+    Returns:
+        list of tuple: (variant_path, textcolor, pagecolor) for every variant.
+    """
+    folder, png_file = os.path.split(file_path)
+    variant_suffix = png_file[len(f"content_{base_textcolor}text_{base_pagecolor}page_"):]
+
+    variants = []
+    for pagecolor in pagecolors:
+        for textcolor in textcolors:
+            if pagecolor == textcolor or (textcolor, pagecolor) == (base_textcolor, base_pagecolor):
+                continue
+            variant_path = os.path.join(folder, f"content_{textcolor}text_{pagecolor}page_{variant_suffix}")
+            variants.append((variant_path, textcolor, pagecolor))
+    return variants
+
+def draw_grid(img, dpi=500, spacing_mm=5, color=(204, 204, 204), thickness_pt=0.4):
+    """
+    Draw a square grid behind the content of an image.
+
+    The lines are combined with a darken blend, so the text stays on top of them like
+    with the grid drawn by the header in the background of the page.
+
+    Args:
+        img (Pillow.Image): Input image.
+        dpi (int): Resolution the image was rendered at.
+        spacing_mm (float): Distance between two grid lines in millimeters.
+        color (tuple): RGB color of the lines (the header draws black!20).
+        thickness_pt (float): Thickness of the lines in points (the header draws "thin").
+
+    Returns:
+        Pillow.Image: RGB image with the grid.
+    """
+    img = np.array(img.convert("RGB"))
+    height, width = img.shape[:2]
+    spacing = dpi * spacing_mm / 25.4
+    thickness = max(1, round(dpi * thickness_pt / 72.27))
+    color = np.array(color, dtype=np.uint8)
+
+    # Like TikZ, the grid starts at the lower left corner of the page
+    rows = np.zeros(height, dtype=bool)
+    for y in np.arange(height - 1, -1, -spacing).round().astype(int):
+        rows[max(0, y - thickness + 1):y + 1] = True
+    cols = np.zeros(width, dtype=bool)
+    for x in np.arange(0, width, spacing).round().astype(int):
+        cols[x:x + thickness] = True
+
+    img[rows] = np.minimum(img[rows], color)
+    img[:, cols] = np.minimum(img[:, cols], color)
+    return Image.fromarray(img, "RGB")
+
+@TRACER.traced()
+def add_grid_variants(directory="data/generated", dpi=500, spacing_mm=5, color=(204, 204, 204), thickness_pt=0.4):
+    """
+    Write a grid version of every "nogrid" PNG in the specified directory.
+
+    Use it with headers created with grid=False, so that grid and no-grid outputs come
+    from a single compilation. See draw_grid for the parameters.
+    """
+    print("Adding grids...")
+    folders = get_subfolders(directory)
+    for folder in folders:
+        folder = os.path.join(directory, folder)
+        png_files = [f for f in os.listdir(folder) if f.endswith("_nogrid.png")]
+
+        for png_file in png_files:
+            add_grid_png(os.path.join(folder, png_file), dpi, spacing_mm, color, thickness_pt)
+
+@TRACER.traced("raster", outputs=lambda png_path: [png_path])
+def add_grid_png(file_path, dpi=500, spacing_mm=5, color=(204, 204, 204), thickness_pt=0.4):
+    """
+    Write the grid version of a single "nogrid" PNG, see draw_grid for the parameters.
+
+    Returns:
+        str: Path of the grid version.
+    """
+    grid_file_path = file_path[:-len("_nogrid.png")] + "_grid.png"
+    with Image.open(file_path) as img:
+        draw_grid(img, dpi, spacing_mm, color, thickness_pt).save(grid_file_path)
+    return grid_file_path
+
+@TRACER.traced("raster", outputs=lambda png_paths: png_paths)
+def rasterize_and_augment(pdf_path, dpi=500, textcolors=None, pagecolors=None, raster_grid=False,
+                          write_clean=True, noise_level=100, blur_radius=2, rng=None):
+    """
+    Render a PDF and write its augmented versions, handing the rendered page to the
+    augmentation in memory instead of writing a PNG and decoding it again.
+
+    The color and grid variants (see derive_color_variants and add_grid_variants) are
+    derived from the rendered page in memory too.
+
+    Args:
+        pdf_path (str): Path of the PDF, the PNGs are written next to it.
+        dpi (int): Resolution of the PNGs.
+        textcolors (list of str): If given, the PDF is black on white and the other
+            colors are derived from it.
+        pagecolors (list of str): Page colors derived along with textcolors.
+        raster_grid (bool): Also write a grid version of the "nogrid" variants.
+        write_clean (bool): Also write the PNGs without noise and blur.
+        noise_level (int): Amplitude of the noise.
+        blur_radius (float): Radius of the Gaussian blur.
+        rng (numpy.random.Generator): Generator of the noise.
+
+    Returns:
+        list of str: Paths of the written images.
+    """
+    page = render_pdf_pages(pdf_path, dpi, first_page_only=True)[0]
+    png_path = os.path.splitext(pdf_path)[0] + ".png"
+
+    # The rendered page is the black on white variant
+    variants = [(png_path, None, None)]
+    if textcolors is not None:
+        base = Image.fromarray(page, "RGB")
+        if "black" not in textcolors or "white" not in pagecolors:
+            variants = []
+        variants += color_variants(png_path, textcolors, pagecolors)
+
+    written = []
+    for variant_path, textcolor, pagecolor in variants:
+        pixels = page if textcolor is None else np.asarray(recolor_image(base, textcolor, pagecolor))
+        outputs = [(variant_path, pixels)]
+        if raster_grid and variant_path.endswith("_nogrid.png"):
+            grid_path = variant_path[:-len("_nogrid.png")] + "_grid.png"
+            outputs.append((grid_path, np.asarray(draw_grid(Image.fromarray(pixels, "RGB"), dpi))))
+
+        for output_path, output_pixels in outputs:
+            if write_clean:
+                Image.fromarray(output_pixels, "RGB").save(output_path)
+                written.append(output_path)
+            written += augment_pixels(output_pixels, augmented_paths(output_path), noise_level, blur_radius, rng)
+    return written
+
+def _rasterize_and_augment_job(job):
+    pdf_path, kwargs, seed, key = job
+    try:
+        return rasterize_and_augment(pdf_path, rng=make_rng(seed, key), **kwargs)
+    except Exception as e:
+        print(f"Failed to rasterize {pdf_path}: {e}")
+        return None
+
+@TRACER.traced()
+def rasterize_and_augment_pdfs(input_dir="data/generated", dpi=500, textcolors=None, pagecolors=None, raster_grid=False,
+                               write_clean=True, noise_level=100, blur_radius=2, workers=None, seed=None, manifest=None):
+    """
+    Run rasterize_and_augment on all PDF files in the specified directory with a pool of
+    processes. It replaces convert_pdf_to_pngs, derive_color_variants, add_grid_variants
+    and add_noise_and_blur.
+
+    If a BuildManifest is given, the PDFs processed before with the same parameters are skipped.
+    """
+    print("Rasterizing and augmenting PDF files...")
+    kwargs = {"dpi": dpi, "textcolors": textcolors, "pagecolors": pagecolors, "raster_grid": raster_grid,
+              "write_clean": write_clean, "noise_level": noise_level, "blur_radius": blur_radius}
+
+    pdf_paths = []
+    for folder in get_subfolders(input_dir):
+        folder = os.path.join(input_dir, folder)
+        pdf_paths += sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".pdf"))
+
+    inputs = {}
+    if manifest is not None:
+        for pdf_path in pdf_paths:
+            inputs[pdf_path] = hash_values(hash_file(pdf_path), kwargs, seed)
+        pdf_paths = [p for p in pdf_paths if not manifest.is_fresh("raster_augment", p, inputs[p])]
+    if not pdf_paths:
+        return
+
+    jobs = [(pdf_path, kwargs, seed, rng_key(pdf_path, input_dir)) for pdf_path in pdf_paths]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        results = list(executor.map(_rasterize_and_augment_job, jobs))
+
+    failed = 0
+    for pdf_path, written in zip(pdf_paths, results):
+        if written is None:
+            failed += 1
+        elif manifest is not None:
+            manifest.record("raster_augment", pdf_path, inputs[pdf_path], written)
+    print(f"Rasterized {len(pdf_paths) - failed}/{len(pdf_paths)} PDF files.")
+
+@TRACER.traced()
+def add_noise_and_blur(directory="data/generated", noise_level=100, blur_radius=2, manifest=None, workers=None, seed=None):
+    """
+    Generates noisy and blurred versions of PNG images in the specified directory.
+
+    The images are augmented by a pool of processes, see augment_pngs.
+    If a BuildManifest is given, the images augmented before with the same parameters are skipped.
+    """
     print("Adding noise and blur...")
     if not os.path.exists(directory):
         return
+    file_paths = []
     folders = get_subfolders(directory)
     for folder in folders:
         folder = os.path.join(directory, folder)
-        png_files = [f for f in os.listdir(folder) if f.endswith(".png")]
-        if not png_files:
-            return
+        png_files = sorted(f for f in os.listdir(folder) if f.endswith(".png") and not is_augmented(f))
+        file_paths += [os.path.join(folder, png_file) for png_file in png_files]
 
-        for png_file in png_files:
-            file_path = os.path.join(folder, png_file)
-            base_name, ext = os.path.splitext(png_file)
-            
-            # Open and convert image to RGB
-            img = Image.open(file_path).convert("RGB")
-            
-            # Create noisy version
-            noise = np.random.randint(-noise_level, noise_level, (img.height, img.width, 3), dtype=np.int16)
-            noisy_img = np.clip(np.array(img) + noise, 0, 255).astype(np.uint8)
-            noisy_img = Image.fromarray(noisy_img)
-            
-            # Save noisy version
-            noisy_file_path = os.path.join(folder, f"{base_name}_noisy{ext}")
-            noisy_img.save(noisy_file_path)
-            
-            # Create and save blurred original
-            blurred_img = img.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            blurred_file_path = os.path.join(folder, f"{base_name}_blurred{ext}")
-            blurred_img.save(blurred_file_path)
-            
-            # Create and save blurred noisy version
-            blurred_noisy_img = noisy_img.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            blurred_noisy_file_path = os.path.join(folder, f"{base_name}_noisy_blurred{ext}")
-            blurred_noisy_img.save(blurred_noisy_file_path)
+    inputs = {}
+    if manifest is not None:
+        for file_path in file_paths:
+            inputs[file_path] = hash_values(hash_file(file_path), noise_level, blur_radius, seed)
+        file_paths = [f for f in file_paths if not manifest.is_fresh("augment", f, inputs[f])]
+
+    results = augment_pngs(file_paths, noise_level, blur_radius, workers, seed, directory)
+
+    if manifest is not None:
+        for file_path, output_paths in zip(file_paths, results):
+            manifest.record("augment", file_path, inputs[file_path], output_paths)
 
 def get_font_template(font_name: str):
   """Generate LaTeX font configuration for a specified font, including special handling for 'ML4Science' font."""
@@ -266,11 +970,12 @@ def get_font_template(font_name: str):
     }
 ]
 \setmathsfont(Digits,Latin){ML4Science}
+\newfontfamily{\mlsciencefont}{ML4Science}
 \DeclareSymbolFont{operators}{\encodingdefault}{\rmdefault}{m}{n}
 \SetSymbolFont{operators}{normal}{\encodingdefault}{\rmdefault}{m}{n}
 \DeclareTextSymbol{\textapostrophe}{T1}{39}
 \catcode`'=\active
-\def'{\text{\fontspec{ML4Science}\symbol{"27}}}
+\def'{\text{\mlsciencefont\symbol{"27}}}
 \DeclareMathSymbol{=}{\mathrel}{operators}{"3D}
 \DeclareMathSymbol{-}{\mathbin}{operators}{"2D}
 \DeclareMathSymbol{/}{\mathord}{operators}{"2F}  
@@ -279,23 +984,23 @@ def get_font_template(font_name: str):
 \DeclareMathSymbol{>}{\mathrel}{operators}{"3E}
 \DeclareMathSymbol{\leq}{\mathrel}{operators}{"3C}
 \DeclareMathSymbol{\geq}{\mathrel}{operators}{"3E}
-\renewcommand{\subset}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2282}}}}
-\renewcommand{\supset}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2283}}}}
-\renewcommand{\in}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2208}}}}
-\renewcommand{\approx}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2248}}}}
-\renewcommand{\forall}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2200}}}}
+\renewcommand{\subset}{\mathrel{\text{\mlsciencefont\symbol{"2282}}}}
+\renewcommand{\supset}{\mathrel{\text{\mlsciencefont\symbol{"2283}}}}
+\renewcommand{\in}{\mathrel{\text{\mlsciencefont\symbol{"2208}}}}
+\renewcommand{\approx}{\mathrel{\text{\mlsciencefont\symbol{"2248}}}}
+\renewcommand{\forall}{\mathrel{\text{\mlsciencefont\symbol{"2200}}}}
 \DeclareMathSymbol{\pm}{\mathbin}{operators}{"B1}
-\renewcommand{\Rightarrow}{\mathrel{\text{\fontspec{ML4Science}\symbol{"2192}}}}
+\renewcommand{\Rightarrow}{\mathrel{\text{\mlsciencefont\symbol{"2192}}}}
 \let\implies\Rightarrow
-\renewcommand{\infty}{\text{\fontspec{ML4Science}∞}}
-\renewcommand{\cdot}{\mathbin{\text{\fontspec{ML4Science}\symbol{"2219}}}}
-\renewcommand{\int}{\mathop{\text{\fontspec{ML4Science}\symbol{"222B}}}\displaylimits}
+\renewcommand{\infty}{\text{\mlsciencefont∞}}
+\renewcommand{\cdot}{\mathbin{\text{\mlsciencefont\symbol{"2219}}}}
+\renewcommand{\int}{\mathop{\text{\mlsciencefont\symbol{"222B}}}\displaylimits}
 \makeatletter
 \renewcommand{\frac}[2]{%
   \sbox\z@{$\displaystyle\begin{array}{c}#1\\#2\end{array}$}% 
   \mathop{%
     \kern 0.4em
-    \hbox to \wd\z@{\text{\fontspec{ML4Science}}\leaders\hbox{\symbol{"2014}}\hfill}%
+    \hbox to \wd\z@{\text{\mlsciencefont}\leaders\hbox{\symbol{"2014}}\hfill}%
   }\limits^{\ensuremath{\displaystyle #1}}_{\ensuremath{\displaystyle #2}}% 
 }
 \makeatother
@@ -304,7 +1009,7 @@ def get_font_template(font_name: str):
   \sbox\z@{$#1$}%
   \raisebox{\dimexpr-\dp\z@}{%   
     \resizebox{!}{\dimexpr\ht\z@+\dp\z@+2pt}{%
-      \text{\fontspec{ML4Science}√}%
+      \text{\mlsciencefont√}%
     }%
   }%
 }
@@ -313,7 +1018,7 @@ def get_font_template(font_name: str):
     \sbox\z@{$#1$}%  
     \kern-\dimexpr\ht\z@ + \dp\z@ + 1em\relax% 
     \hbox to \dimexpr\wd\z@ + 0.41em\relax{% 
-        \leaders\hbox{\text{\fontspec{ML4Science}\symbol{"2015}}}\hfill%
+        \leaders\hbox{\text{\mlsciencefont\symbol{"2015}}}\hfill%
     }%
     \kern\dimexpr\ht\z@ - 1.28em\relax%  
     \box\z@
@@ -494,8 +1199,31 @@ def get_strike_design():
     strike_code = random.choice(strikes)
     return strike_code
 
-def add_irregularities(tex_content):
-    """Add irregularities to the word alignements."""
+def irregular_words(line, rng):
+    """
+    Shift and rotate every word of a line with plain LaTeX boxes.
+
+    Draws the same random y-shift (-1.5pt to 1.5pt) and rotation (-5° to 5°) per
+    word as the \\irregularword macro, without any pgfmath or TikZ work in TeX.
+    """
+    words = []
+    for word in line.split():
+        yshift = (rng.random() - 0.5) * 3
+        rotation = (rng.random() - 0.5) * 10
+        words.append(r'\raisebox{%.2fpt}{\rotatebox[origin=c]{%.2f}{\strut %s}}' % (yshift, rotation, word))
+    return ' '.join(words)
+
+def add_irregularities(tex_content, engine="tikz", seed=None):
+    """
+    Add irregularities to the word alignements.
+
+    Args:
+        tex_content (str): The content of a TeX file.
+        engine (str): "tikz" wraps plain lines in \\processtext and lets TeX draw the
+            irregularities, "python" draws them here with a reproducible seed.
+        seed: Seed of the "python" engine.
+    """
+    rng = random.Random(seed)
     lines = tex_content.split('\n')
     modified_lines = []
     skip_processing_bracket = False
@@ -517,6 +1245,8 @@ def add_irregularities(tex_content):
             modified_lines.append(line)
         elif '\\' in line or '[' in line or ']' in line or '$' in line or '{' in line or '}' in line or '_' in line or '#' in line:
             modified_lines.append(line)
+        elif engine == "python":
+            modified_lines.append(irregular_words(line, rng))
         else:
             modified_line = r'\processtext{' + line + '}'
             modified_lines.append(modified_line)